@@ -1,6 +1,11 @@
+import asyncio
+import contextlib
+import functools
 import json
+import os
 import random
-from datetime import datetime
+from datetime import date
+from typing import Optional
 
 import anyio
 from nonebot import logger, on_command
@@ -15,8 +20,8 @@ from nonebot.params import CommandArg
 from nonebot.permission import SUPERUSER
 from nonebot.plugin import PluginMetadata, get_plugin_config
 
-from .model import Config, DoroEnding, DoroEndingManager
-from .resourse import download_doro_assets
+from .model import Config, DoroEnding, DoroEndingManager, dumps_json, loads_json
+from .resourse import adownload_doro_assets
 
 # 全局管理器实例
 _doro_manager: DoroEndingManager = DoroEndingManager()
@@ -49,12 +54,27 @@ __all__ = [
 from nonebot import get_driver
 
 driver = get_driver()
-# 保存加载的数据
-data: dict = {}
-# 保存用户和结局的映射
-user_doro_map: dict = {}
+# 插件数据目录及其中的文件路径
+DATA_DIR = "./data/nonebot_plugin_doroending"
+DATE_RECORD_FILE = f"{DATA_DIR}/doro_date_record.json"
+USER_MAP_FILE = f"{DATA_DIR}/user_doro_map.json"
+PIC_DIR = f"{DATA_DIR}/DoroEndingPic"
+# 保存用户和结局的映射（用户ID -> 结局ID）
+user_doro_map: dict[int, int] = {}
 # 保存当前数据的日期
 current_date: str = ""
+# 结局图片目录的绝对路径（启动时解析一次）
+pic_dir: str = ""
+# 结局列表分页文本缓存：(数据版本号, 分页文本列表)
+_list_cache: Optional[tuple[int, list[str]]] = None
+# 用户结局映射是否有待写入的修改
+_map_dirty: asyncio.Event = asyncio.Event()
+# 后台写入任务
+_map_flush_task: Optional[asyncio.Task] = None
+# 用户结局映射的写入锁，保证同一时间只有一次写入
+_map_write_lock: asyncio.Lock = asyncio.Lock()
+# 合并写入的等待时间（秒）
+MAP_FLUSH_DELAY = 0.5
 
 @driver.on_startup
 async def startup():
@@ -62,12 +82,24 @@ async def startup():
     global _doro_manager  # noqa: PLW0602
     global user_doro_map  # noqa: PLW0603
     global current_date  # noqa: PLW0603
-    loaded = await _doro_manager.load_from_file()
+    global _map_flush_task  # noqa: PLW0603
+    global pic_dir  # noqa: PLW0603
+    # 结局数据、日期记录、用户映射和图片目录互不依赖，并发加载
+    loaded, date_record, map_record, pic_dir_path = await asyncio.gather(
+        _doro_manager.load_from_file(),
+        aread_dict_from_json(
+            filename=DATE_RECORD_FILE
+            ),
+        aread_dict_from_json(
+            filename=USER_MAP_FILE
+            ),
+        anyio.Path(PIC_DIR).resolve(),
+    )
     # 如果本地没有数据，则尝试从github下载
     if not loaded:
         logger.warning("本地无结局数据 即将从github上下载...")
-        result = download_doro_assets(
-            target_dir="./data/nonebot_plugin_doroending",
+        result = await adownload_doro_assets(
+            target_dir=DATA_DIR,
             token=config.GITHUB_TOKEN
             )
         logger.info(f"最终结果: {result['success']}")
@@ -75,27 +107,76 @@ async def startup():
         if result['json_data']:
             logger.info(f"JSON记录数: {len(result['json_data'])}")
         logger.info(f"保存路径: {result['local_path']}")
-    # 尝试再次加载数据
-    loaded = await _doro_manager.load_from_file()
+        # 下载后尝试再次加载数据
+        loaded = await _doro_manager.load_from_file()
+    # 检查结局引用的图片是否都存在，缺失时汇总记录一次
+    if loaded:
+        missing = await _doro_manager.find_missing_images()
+        if missing:
+            logger.warning(
+                f"{len(missing)} 个结局的图片文件不存在: "
+                + ", ".join(f"{ending.id}({ending.pic})" for ending in missing)
+                )
     logger.debug("当前结局数据统计信息：")
-    logger.debug(_doro_manager.get_statistics())
-    logger.debug("结局列表如下")
+    logger.opt(lazy=True).debug("{}", _doro_manager.get_statistics)
     # 加载日期记录
-    current_date = read_dict_from_json(
-        filename="./data/nonebot_plugin_doroending/doro_date_record.json"
-        ).get("date", "")
-    # 加载文件中保存的用户结局映射
-    user_doro_map = read_dict_from_json(
-        filename="./data/nonebot_plugin_doroending/user_doro_map.json"
-        )
+    current_date = date_record.get("date", "")
+    # 加载文件中保存的用户结局映射（JSON的键只能是字符串，这里转换回整数）
+    user_doro_map = {
+        int(user_id): doro_id for user_id, doro_id in map_record.items()
+    }
+    # 图片目录的绝对路径，避免每次请求都访问文件系统
+    pic_dir = str(pic_dir_path)
     logger.info(f"加载日期记录: {current_date}")
     logger.info(f"已加载用户结局映射记录数: {len(user_doro_map)}")
-    logger.debug(f"当前用户结局映射: {user_doro_map}")
-    logger.debug(_doro_manager.get_all_endings())
+    # 调试信息仅在DEBUG级别启用时才格式化
+    logger.opt(lazy=True).debug("当前用户结局映射: {}", lambda: user_doro_map)
+    logger.opt(lazy=True).debug("结局列表如下: {}", _doro_manager.get_all_endings)
+    # 启动用户结局映射的后台写入任务
+    _map_flush_task = asyncio.create_task(_flush_user_doro_map_loop())
 
     logger.info("doro结局插件已启动")
 
 
+@driver.on_shutdown
+async def shutdown():
+    # 将尚未写入的结局数据落盘
+    await _doro_manager.flush()
+    # 关闭下载图片使用的HTTP会话
+    await _doro_manager.close()
+    # 停止后台写入任务，并将未写入的映射落盘
+    # 先取得写入锁：等待进行中的写入完成，避免与下面的写入同时操作临时文件
+    async with _map_write_lock:
+        if _map_flush_task is not None:
+            _map_flush_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await _map_flush_task
+        if _map_dirty.is_set():
+            _map_dirty.clear()
+            await awrite_dict_to_json(
+                user_doro_map,
+                filename=USER_MAP_FILE
+                )
+    logger.info("doro结局插件已关闭")
+
+
+async def _flush_user_doro_map_loop():
+    """
+    后台合并写入用户结局映射
+    每次有修改后等待 MAP_FLUSH_DELAY 秒，把这段时间内的所有修改一次性写入文件
+    """
+    while True:
+        await _map_dirty.wait()
+        await asyncio.sleep(MAP_FLUSH_DELAY)
+        async with _map_write_lock:
+            # 先清除标记，写入期间产生的新修改会触发下一轮写入
+            _map_dirty.clear()
+            await awrite_dict_to_json(
+                user_doro_map,
+                filename=USER_MAP_FILE
+                )
+
+
 get_doro_ending = on_command("今日doro结局")
 add_doro_ending = on_command("添加doro结局", permission=SUPERUSER)
 remove_doro_ending = on_command("删除doro结局", permission=SUPERUSER)
@@ -109,91 +190,67 @@ async def handle_doro_ending(
     # 获取当前日期
     global current_date  # noqa: PLW0603
     global _doro_manager  # noqa: PLW0602
-    today = datetime.now().strftime("%Y-%m-%d")
+    today = date.today().isoformat()
     # 如果日期已过期，清空用户结局映射并更新日期
     if current_date != today:
         logger.info(f"日期已过期，清空用户结局映射。原日期: {current_date}, 今天: {today}")
         user_doro_map.clear()
         current_date = today
         # 保存新的日期记录
-        write_dict_to_json({"date": current_date}, filename="./data/nonebot_plugin_doroending/doro_date_record.json")
-        # 清空用户映射文件
-        write_dict_to_json({}, filename="./data/nonebot_plugin_doroending/user_doro_map.json")
+        await awrite_dict_to_json({"date": current_date}, filename=DATE_RECORD_FILE)
+        # 标记用户映射文件待清空
+        _map_dirty.set()
     # 判断是否已有记录
     # 日志记录当前用户ID和现有的用户结局映射
     logger.debug(f"当前用户ID: {event.user_id}")
-    logger.debug(f"现有用户结局映射: {user_doro_map}")
+    logger.opt(lazy=True).debug("现有用户结局映射: {}", lambda: user_doro_map)
     # 如果用户已有记录，直接使用已有的结局
-    if str(event.user_id) in user_doro_map:
+    doro_info = None
+    doro_id = user_doro_map.get(event.user_id)
+    if doro_id is not None:
         logger.debug(f"用户（{event.user_id}）已有记录，使用已有结局")
-        # 获取用户对应的结局id
-        doro_id = user_doro_map[str(event.user_id)]
         # 查找对应的结局信息
         doro_info = _doro_manager.get_ending_by_id(doro_id)
-        if doro_info:
-            # 找到结局，返回图片
-            abs_image_path = await anyio.Path(
-                f"./data/nonebot_plugin_doroending/DoroEndingPic/{doro_info.pic}"
-                ).resolve()
-            await get_doro_ending.finish(MessageSegment.image(f"file://{abs_image_path}"))
-        else:
+        if doro_info is None:
             # 如果找不到对应的结局，移除记录
-            del user_doro_map[event.user_id]
+            user_doro_map.pop(event.user_id, None)
             logger.debug(f"用户（{event.user_id}）的结局记录无效，重新选择结局")
     else:
         logger.debug(f"用户（{event.user_id}）没有记录，随机选择结局")
+    if doro_info is None:
+        endings = _doro_manager.sorted_endings
+        if not endings:
+            await get_doro_ending.finish("当前没有任何doro结局数据！")
         # 随机选择一个结局
-        data: list[DoroEnding] = _doro_manager.get_all_endings()
-        doro_ending = random.randint(1, _doro_manager.get_statistics()["total"])
-        doro_info = data[doro_ending - 1]
+        doro_info = random.choice(endings)
         # 记录用户和结局的映射
-        user_doro_map[str(event.user_id)] = doro_info.id
-        # 保存映射到文件
-        write_dict_to_json(
-            user_doro_map,
-            filename="./data/nonebot_plugin_doroending/user_doro_map.json"
-            )
+        user_doro_map[event.user_id] = doro_info.id
+        # 标记映射待写入，由后台任务合并保存
+        _map_dirty.set()
         logger.debug(f"记录用户（{event.user_id}）的结局ID为 {doro_info.id}")
-        # 构建图片路径
-        image_path = await anyio.Path(
-            f"./data/nonebot_plugin_doroending/DoroEndingPic/{doro_info.pic}"
-            ).resolve()
-        # 返回图片消息
-        await get_doro_ending.finish(MessageSegment.image(f"file://{image_path}"))
+    # 构建图片路径
+    image_path = f"{pic_dir}/{doro_info.pic}"
+    # 返回图片消息
+    await get_doro_ending.finish(MessageSegment.image(f"file://{image_path}"))
 
 @add_doro_ending.handle()
 # 处理添加doro结局的命令
 async def handle_add_doro_ending(
-    event: MessageEvent,
     args: Message = CommandArg()
     ) -> None:
-    # 获取原始消息
-    raw_message = event.raw_message
-    # 分离命令部分，获取参数
-    cmd_len = len("/添加doro结局")
-    params = raw_message[cmd_len:].strip()
-    # 检查是否有参数
-    if not params:
+    # 检查是否有参数（CommandArg 已去除命令前缀，兼容任意命令起始符）
+    if not args:
         await add_doro_ending.finish(
             "请提供两个名字和一张图片，格式：/添加doro结局 中文名 英文名 [图片]"
             )
-    # 检查消息中是否有图片
-    has_image = False
-    image_url = None
-    # 从事件消息中提取图片
-    for segment in event.message:
-        if segment.type == "image":
-            has_image = True
-            # 获取图片URL（不同适配器可能有不同字段）
-            if "url" in segment.data:
-                image_url = segment.data["url"]
-            elif "file" in segment.data:
-                image_url = segment.data["file"]
-            break
-    if not has_image:
+    # 从命令参数中取第一张图片（忽略回复/引用中的图片）
+    image = next((segment for segment in args if segment.type == "image"), None)
+    if image is None:
         await add_doro_ending.finish(
             "请提供一张图片！格式：/添加doro结局 中文名 英文名 [图片]"
             )
+    # 获取图片URL（不同适配器可能有不同字段）
+    image_url = image.data.get("url") or image.data.get("file")
     # 提取纯文本部分（去除图片CQ码）
     # 先获取纯文本参数
     text_args = args.extract_plain_text().strip()
@@ -214,7 +271,7 @@ async def handle_add_doro_ending(
         english_name = english_name,
         image_url = image_url
         )
-        await _doro_manager.save_to_file()  # 保存数据到文件
+        _doro_manager.request_save()  # 延迟保存，短时间内的多次修改合并为一次写入
         await add_doro_ending.finish("doro结局添加成功！")
     except ValueError as ve:
         await add_doro_ending.finish(f"添加doro结局失败: {ve}")
@@ -234,7 +291,8 @@ async def handle_rdoro_ending(
             "例如：/删除doro结局 123 或 /删除doro结局 结局名称"
         )
     try:
-        await _doro_manager.remove_ending(target)
+        if await _doro_manager.remove_ending(target):
+            _doro_manager.request_save()  # 延迟保存，短时间内的多次修改合并为一次写入
         await remove_doro_ending.finish("doro结局删除成功！")
     except ValueError as ve:
         await remove_doro_ending.finish(f"删除doro结局失败: {ve}")
@@ -245,37 +303,54 @@ async def handle_list_doro_endings(
     event: MessageEvent,
     bot: Bot
 ) -> None:
-    # 获取所有结局数据
-    data: list[DoroEnding] = _doro_manager.get_all_endings()
-    tatal = _doro_manager.get_statistics()["total"]
-    if tatal == 0:
+    global _list_cache  # noqa: PLW0603
+    if _doro_manager.total == 0:
         await list_doro_endings.finish("当前没有任何doro结局数据！")
-    # 按ID排序
-    data.sort(key=lambda x: x.id)
-    # 构建合并转发节点列表
-    nodes = []
-    nodes.append(
-        ("doro结局", bot.self_id, Message("以下是所有doro结局"))
-    )
-    # 每50个结局放一条消息
-    split_num = 50
-    pair = []
-    for idx, data_item in enumerate(data, 1):
-        msg = (
-            f"{data_item.id}. {data_item.name}\n"
-        )
-        pair.append(msg)
-        if len(pair) == split_num or idx == len(data):
-            nodes.append(("doro结局", bot.self_id, Message("".join(pair))))
-            pair = []
+    # 结局数据有变动时才重新生成分页文本
+    if _list_cache is None or _list_cache[0] != _doro_manager.version:
+        _list_cache = (
+            _doro_manager.version,
+            build_list_pages(_doro_manager.sorted_endings)
+            )
+    # 直接构建合并转发节点，省去中间的 Message 对象和转换步骤
+    nodes = [build_forward_node(bot.self_id, "以下是所有doro结局")]
+    nodes.extend(build_forward_node(bot.self_id, page) for page in _list_cache[1])
     # 发送合并转发消息
     await send_forward_msg(bot, event, nodes)
     await list_doro_endings.finish()
 
+def build_list_pages(data: tuple[DoroEnding, ...]) -> list[str]:
+    """
+    将结局列表按每50个一页拼接成文本
+    Args:
+        data: 按ID排序的结局数据
+    Returns:
+        每一页的文本列表
+    """
+    split_num = 50
+    return [
+        "".join(f"{item.id}. {item.name}\n" for item in data[i:i + split_num])
+        for i in range(0, len(data), split_num)
+    ]
+
+def build_forward_node(uin: str, text: str) -> dict:
+    """
+    构建一个纯文本的 forward 消息节点
+    内容直接使用消息段的 json 格式，避免文本被当作CQ码解析
+    """
+    return {
+        "type": "node",
+        "data": {
+            "name": "doro结局",
+            "uin": uin,
+            "content": [{"type": "text", "data": {"text": text}}],
+        },
+    }
+
 async def send_forward_msg(
     bot: Bot,
     event: MessageEvent,
-    user_message: list[tuple[str, str, Message]],
+    messages: list[dict],
 ):
     """
     发送 forward 消息
@@ -283,24 +358,12 @@ async def send_forward_msg(
     > 参数：
         - bot: Bot 对象
         - event: MessageEvent 对象
-        - user_message: 合并消息的用户信息列表
+        - messages: 已构建好的 forward 消息节点列表
 
     > 返回值：
         - 成功：返回消息发送结果
         - 失败：抛出异常
     """
-
-    def to_json(info: tuple[str, str, Message]):
-        """
-        将消息转换为 forward 消息的 json 格式
-        """
-        return {
-            "type": "node",
-            "data": {"name": info[0], "uin": info[1], "content": info[2]},
-        }
-
-    messages = [to_json(info) for info in user_message]
-
     if isinstance(event, GroupMessageEvent):
         await bot.call_api(
             "send_group_forward_msg", group_id=event.group_id, messages=messages
@@ -310,21 +373,38 @@ async def send_forward_msg(
             "send_private_forward_msg", user_id=event.user_id, messages=messages
         )
 
-def write_dict_to_json(data_dict, filename="./data/nonebot_plugin_doroending/user_doro_map.json"):
+def write_dict_to_json(data_dict, filename=USER_MAP_FILE):
     """
-    将Python字典写入JSON文件
+    将Python字典写入JSON文件（整数键会被序列化为字符串）
+    先写入临时文件再原子替换，写入中途崩溃不会损坏原文件
     Args:
         data_dict: 要写入的字典
         filename: 文件名，默认为 "user_doro_map.json"
     """
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data_dict, f, ensure_ascii=False, indent=2)
+        # 序列化与写入在同一次调用中完成，便于整体交给工作线程
+        content = dumps_json(data_dict)
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_filename, filename)
         logger.debug(f"字典已成功写入 {filename}")
     except Exception as e:
         logger.error(f"写入文件时出错: {e}")
 
-def read_dict_from_json(filename="./data/nonebot_plugin_doroending/user_doro_map.json"):
+async def awrite_dict_to_json(data_dict, filename=USER_MAP_FILE):
+    """
+    在工作线程中将Python字典写入JSON文件，避免阻塞事件循环
+    Args:
+        data_dict: 要写入的字典
+        filename: 文件名，默认为 "user_doro_map.json"
+    """
+    # 先做浅拷贝，防止工作线程序列化期间字典被其他处理器修改
+    await anyio.to_thread.run_sync(
+        functools.partial(write_dict_to_json, dict(data_dict), filename)
+        )
+
+def read_dict_from_json(filename=USER_MAP_FILE):
     """
     从JSON文件中读取Python字典
     Args:
@@ -333,8 +413,8 @@ def read_dict_from_json(filename="./data/nonebot_plugin_doroending/user_doro_map
         读取到的字典，如果读取失败则返回空字典
     """
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(filename, 'rb') as f:
+            data = loads_json(f.read())
         logger.debug(f"字典已成功从 {filename} 读取")
         return data
     except FileNotFoundError:
@@ -346,3 +426,13 @@ def read_dict_from_json(filename="./data/nonebot_plugin_doroending/user_doro_map
     except Exception as e:
         logger.error(f"读取文件时出错: {e}")
         return {}
+
+async def aread_dict_from_json(filename=USER_MAP_FILE):
+    """
+    在工作线程中从JSON文件读取Python字典，打开、读取和解析只占用一次线程调度
+    Args:
+        filename: 文件名，默认为 "user_doro_map.json"
+    Returns:
+        读取到的字典，如果读取失败则返回空字典
+    """
+    return await anyio.to_thread.run_sync(read_dict_from_json, filename)
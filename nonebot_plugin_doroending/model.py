@@ -1,16 +1,75 @@
 import asyncio
-import imghdr
+import functools
+import hashlib
 import json
-import re
-from dataclasses import asdict, dataclass, field
+import mmap
+import operator
+import os
+import shutil
+from dataclasses import dataclass, is_dataclass
 from pathlib import Path
-from typing import Any, ClassVar, Optional, TypedDict
+from typing import Any, Callable, ClassVar, Optional, TypedDict, Union
 
 import aiohttp
 import anyio
 from nonebot import logger
 from pydantic import BaseModel
 
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，未安装时回退到标准库 json
+    orjson = None
+
+# 下载图片时累积到该大小后再写入磁盘
+WRITE_BATCH_SIZE = 1024 * 1024
+# 计算已有图片哈希时每次读取的大小
+HASH_CHUNK_SIZE = 1024 * 1024
+# 建立图片哈希索引时并行使用的工作线程数（hashlib 计算时会释放GIL）
+HASH_WORKERS = 4
+
+# 文件名中的非法字符替换表（str.translate 为 C 层循环，比正则替换更快）
+_ILLEGAL_FILENAME_TRANS = str.maketrans(dict.fromkeys('<>:"/\\|?*', "_"))
+
+
+def _json_default(obj: Any) -> Any:
+    """标准库 json 无法直接序列化数据类，这里转换为字典"""
+    if is_dataclass(obj) and not isinstance(obj, type):
+        # 直接按字段取值，避免 asdict 的递归深拷贝
+        return {name: getattr(obj, name) for name in obj.__dataclass_fields__}
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+def dumps_json(obj: Any) -> bytes:
+    """将对象序列化为紧凑的JSON字节串（已安装orjson时优先使用，支持直接序列化数据类）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    content = json.dumps(
+        obj, ensure_ascii=False, separators=(",", ":"), default=_json_default
+        )
+    return content.encode("utf-8")
+
+
+def loads_json(content: Union[bytes, str]) -> Any:
+    """解析JSON字节串或字符串（已安装orjson时优先使用）"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """根据文件头的魔数识别图片格式，返回格式名（与imghdr一致），无法识别时返回None"""
+    if header[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if header[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header[:2] == b"BM":
+        return "bmp"
+    return None
+
 
 class Config(BaseModel):
     """插件配置类"""
@@ -24,26 +83,35 @@ class ImageConfig:
     timeout: int = 30  # 秒
     allowed_extensions: tuple = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
     max_filename_length: int = 255
-    # Content-Type 到文件扩展名的映射 - 使用 ClassVar 注解
-    content_type_to_ext: ClassVar[dict[str, str]] = field(
-        default_factory=lambda: {
-            "image/jpeg": ".jpg",
-            "image/jpg": ".jpg",
-            "image/png": ".png",
-            "image/gif": ".gif",
-            "image/webp": ".webp",
-            "image/bmp": ".bmp",
-        }
-    )
+    max_connections: int = 32  # 下载连接池大小
+    max_concurrent_downloads: int = 8  # 同时进行的图片下载数
+    # Content-Type 到文件扩展名的映射（类级常量，所有实例共享）
+    content_type_to_ext: ClassVar[dict[str, str]] = {
+        "image/jpeg": ".jpg",
+        "image/jpg": ".jpg",
+        "image/png": ".png",
+        "image/gif": ".gif",
+        "image/webp": ".webp",
+        "image/bmp": ".bmp",
+    }
 
-@dataclass
+@dataclass(slots=True)
 class DoroEnding:
-    """doro结局数据类"""
+    """doro结局数据类（使用 __slots__，减少内存占用并加快属性访问）"""
     id: int
     name: str
     english_name: str
     pic: str = ""
 
+def _build_ending(item: dict[str, Any]) -> DoroEnding:
+    """
+    从插件自己写入的可信数据构建结局对象，仅在加载数据文件时使用
+    按位置传参，省去关键字参数解包，同时忽略多余字段
+    """
+    return DoroEnding(
+        item["id"], item["name"], item["english_name"], item.get("pic", "")
+    )
+
 class DoroEndingUpdate(TypedDict, total=False):
     """doro结局允许修改的数据字典类型"""
     name: str
@@ -60,7 +128,12 @@ class DoroEndingManager:
     doro结局管理器
     load_from_file      读取json
     save_to_file        保存到json
+    request_save        延迟合并保存
+    flush               立即保存待写入的数据
     get_all_endings     获取结局列表
+    sorted_endings      按ID排序的结局列表（缓存）
+    total               结局总数
+    version             数据版本号
     get_ending_by_id    id查询结局
     get_ending_by_name  name查询结局
     search_endings      查询结局
@@ -68,8 +141,10 @@ class DoroEndingManager:
     remove_ending       删除结局
     update_ending       更新结局
     get_statistics      获取统计信息
+    find_missing_images 查找缺少图片的结局
     cleanup_images      清理无用图片
     validate_image_file 验证图片
+    close               关闭HTTP会话
     """
     DUPLICATE_NAME_MSG = "中文名 '{}' 已存在" # 重复名称错误消息模板
     NOT_FOUND_ID_MSG = "未找到ID为 {} 的结局" # 未找到ID错误消息模板
@@ -78,6 +153,14 @@ class DoroEndingManager:
     FILE_TOO_LARGE_MSG = "图片文件过大，最大允许'{}'字节"  # 图片文件过大错误消息模板
     UNSUPPORTED_FORMAT_MSG = "不支持的图片格式，允许的格式:'{}'"  # 不支持的图片格式错误消息模板  # noqa: E501
     SAVE_FAILED_MSG = "图片保存失败'{}'"  # 图片保存失败模板
+    DUPLICATE_IMAGE_MSG = "图片与ID为 {} 的结局重复"  # 重复图片错误消息模板
+    # 需要唯一性检查的字段：(字段名, 取值器, 索引属性名, 错误消息模板, 显示名)
+    _UNIQUE_FIELDS: ClassVar[tuple[tuple[str, Callable[[Any], Any], str, str, str], ...]] = (
+        ("name", operator.attrgetter("name"), "_by_name",
+         DUPLICATE_CHINESE_NAME_MSG, "中文名"),
+        ("english_name", operator.attrgetter("english_name"), "_by_english_name",
+         DUPLICATE_ENGLISH_NAME_MSG, "英文名"),
+    )
     def __init__(
             self,
             data_file: str = "./data/nonebot_plugin_doroending/doroendings.json",
@@ -93,106 +176,223 @@ class DoroEndingManager:
             "total": 0
         }
         self._dirty = False  # 数据是否已修改（需要同步到文件）
-        self._lock = asyncio.Lock()  # 并发锁
+        self._sorted_cache: Optional[tuple[DoroEnding, ...]] = None  # 按ID排序的结局缓存
+        self._by_id: dict[int, DoroEnding] = {}  # ID到结局的索引
+        self._by_name: dict[str, DoroEnding] = {}  # 中文名到结局的索引
+        self._by_english_name: dict[str, DoroEnding] = {}  # 英文名到结局的索引
+        # 搜索索引：ID -> (结局, 小写中文名, 小写英文名)，避免每次搜索都转换大小写
+        self._search_index: dict[int, tuple[DoroEnding, str, str]] = {}
+        self._with_images = 0  # 有图片的结局数量，随索引一起维护
+        self._version = 0  # 数据版本号，结局每次变动时递增
+        self._pending: dict[str, int] = {}  # 正在添加中的结局：中文名 -> 预留ID
+        # 图片内容哈希索引：sha256 -> 结局ID（首次添加结局时才建立，None 表示尚未建立）
+        self._pic_hashes: Optional[dict[str, int]] = None
+        self._hash_by_id: dict[int, str] = {}  # 结局ID -> 图片哈希，用于删除时维护索引
+        self._hash_index_lock = asyncio.Lock()  # 保证哈希索引只建立一次
+        self._session: Optional[aiohttp.ClientSession] = None  # 复用的HTTP会话
+        self._download_semaphore = asyncio.Semaphore(
+            self.image_config.max_concurrent_downloads
+        )  # 限制同时下载的数量
+        self._lock = asyncio.Lock()  # 内存锁：保护内存中的结局数据和索引
+        self._fs_lock = asyncio.Lock()  # 文件锁：串行化数据文件的读写
+        self._flush_task: Optional[asyncio.Task] = None  # 延迟保存任务
+        self._flush_delay = 1.0  # 延迟保存的等待时间（秒），期间的修改合并为一次写入
         self.pic_dir.mkdir(parents=True, exist_ok=True)  # 确保目录存在
     def _raise_value_error(self, msg_template: str, *args: Any):
         """统一的异常抛出函数"""
         raise ValueError(msg_template.format(*args))
 
+    def _index_ending(self, ending: DoroEnding) -> None:
+        """将结局加入ID和名称索引（名称重复时保留先加入的结局）"""
+        self._by_id[ending.id] = ending
+        if ending.pic:
+            self._with_images += 1
+        self._by_name.setdefault(ending.name, ending)
+        self._by_english_name.setdefault(ending.english_name, ending)
+        self._search_index[ending.id] = (
+            ending,
+            ending.name.lower(),
+            ending.english_name.lower(),
+        )
+
+    def _unindex_ending(self, ending: DoroEnding) -> None:
+        """将结局从ID和名称索引中移除"""
+        if self._by_id.pop(ending.id, None) is not None and ending.pic:
+            self._with_images -= 1
+        self._search_index.pop(ending.id, None)
+        if self._by_name.get(ending.name) is ending:
+            del self._by_name[ending.name]
+        if self._by_english_name.get(ending.english_name) is ending:
+            del self._by_english_name[ending.english_name]
+
     async def load_from_file(self) -> bool:
         """从文件加载数据到内存"""
-        async with self._lock:  # 加锁保护
+        async with self._fs_lock:  # 文件锁：读取期间不阻塞内存操作
             try:
-                if not self.data_file.exists():
-                    self._dirty = True  # 没有数据文件，需要后续写入文件
-                    logger.warning(f"数据文件不存在: {self.data_file}")
-                    return False
-                async with await anyio.open_file(
-                    self.data_file,
-                    "r",
-                    encoding="utf-8"
-                    ) as f:
-                    content = await f.read()
-                    # 解析JSON数据
-                    raw_data: dict[str, Any] = json.loads(content)
-                    loaded_data: DoroDataDict = {
-                        "datas": [DoroEnding(**item) for item in raw_data.get("datas", [])],  # noqa: E501
-                        "max_id": int(raw_data.get("max_id", 0)),
-                        "total": int(raw_data.get("total", 0)),
-                        }
-                    # 更新内存数据
-                    self._data = loaded_data
-                    self._dirty = False
-                    logger.info(f"成功加载 {len(self._data['datas'])} 条doro结局数据")
-                    return True
-            except (OSError, json.JSONDecodeError) as e:
+                # 读取和解析在同一次线程调度中完成
+                raw_data: dict[str, Any] = await anyio.to_thread.run_sync(
+                    self._read_data_file
+                )
+            except FileNotFoundError:
+                # 不标记为已修改：否则关闭时会写入空数据文件，下次启动不再尝试下载
+                logger.warning(f"数据文件不存在: {self.data_file}")
+                return False
+            except (OSError, ValueError) as e:
+                logger.error(f"加载数据文件失败: {e}")
+                return False
+            if not isinstance(raw_data, dict):
+                logger.error(
+                    f"加载数据文件失败: 顶层应为JSON对象，实际为 {type(raw_data).__name__}"
+                    )
+                return False
+            try:
+                loaded_data: DoroDataDict = {
+                    "datas": [_build_ending(item) for item in raw_data.get("datas", [])],  # noqa: E501
+                    "max_id": int(raw_data.get("max_id", 0)),
+                    "total": int(raw_data.get("total", 0)),
+                    }
+            except (KeyError, TypeError, ValueError) as e:
                 logger.error(f"加载数据文件失败: {e}")
                 return False
+            async with self._lock:  # 内存锁：仅在替换内存数据时持有
+                self._data = loaded_data
+                self._by_id = {}
+                self._by_name = {}
+                self._by_english_name = {}
+                self._search_index = {}
+                self._with_images = 0
+                self._pic_hashes = None  # 数据已替换，哈希索引需要重新建立
+                self._hash_by_id = {}
+                for item in loaded_data["datas"]:
+                    self._index_ending(item)
+                self._sorted_cache = None
+                self._version += 1
+                self._dirty = False
+            logger.info(f"成功加载 {len(self._data['datas'])} 条doro结局数据")
+            return True
+
+    def _read_data_file(self) -> dict[str, Any]:
+        """
+        读取并解析数据文件（同步执行，需在工作线程中调用）
+        已安装orjson时通过 mmap 直接解析页缓存，避免额外复制一份文件内容
+        """
+        with open(self.data_file, "rb") as f:
+            if orjson is None or os.fstat(f.fileno()).st_size == 0:
+                return loads_json(f.read())
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    return orjson.loads(view)
 
     async def save_to_file(self) -> bool:
         """将内存中的数据保存到文件"""
-        async with self._lock:  # 加锁保护
-            if not self._dirty:
-                logger.debug("数据未修改，跳过保存")
-                return True
-            try:
-                # 准备保存数据
+        async with self._fs_lock:  # 文件锁：保证同一时间只有一次写入
+            async with self._lock:  # 内存锁：仅在生成快照时持有
+                if not self._dirty:
+                    logger.debug("数据未修改，跳过保存")
+                    return True
+                # 准备保存数据（数据类由序列化函数直接处理，无需逐条转换为字典）
                 save_data: dict[str, Any] = {
-                    "datas": [asdict(item) for item in self._data["datas"]],
+                    "datas": list(self._data["datas"]),
                     "max_id": self._data["max_id"],
                     "total": self._data["total"],
                 }
-                # 创建备份文件
-                if self.data_file.exists():
-                    backup_file = self.data_file.with_suffix(".json.bak")
-                    await anyio.Path(self.data_file).rename(backup_file)
-                # 写入新数据
-                async with await anyio.open_file(
-                    self.data_file,
-                    "w",
-                    encoding="utf-8"
-                    ) as f:
-                    await f.write(json.dumps(save_data, ensure_ascii=False, indent=2))
+                self._dirty = False
+            try:
+                # 序列化和写入都在工作线程中完成（一次线程调度完成序列化、写入、备份和替换）
+                await anyio.to_thread.run_sync(self._write_data_file, save_data)
             except OSError as e:
+                self._dirty = True  # 写入失败，保留修改标记以便重试
                 logger.error(f"保存数据文件失败: {e}")
                 return False
-            self._dirty = False
             logger.info("数据已保存到文件")
             return True
 
+    def request_save(self) -> None:
+        """请求保存数据，等待 _flush_delay 秒后写入，期间的多次请求合并为一次写入"""
+        self._dirty = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        """延迟保存任务：保存期间又有新的修改时继续等待并保存，保存失败时停止"""
+        while True:
+            await asyncio.sleep(self._flush_delay)
+            if not await self.save_to_file() or not self._dirty:
+                break
+
+    async def flush(self) -> bool:
+        """取消延迟保存任务并立即保存待写入的数据（用于关闭插件时）"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._flush_task = None
+        return await self.save_to_file()
+
+    def _write_data_file(self, save_data: dict[str, Any]) -> None:
+        """
+        序列化并原子写入数据文件（同步执行，需在工作线程中调用）
+        先写入临时文件并刷入磁盘，再保留旧文件为 .json.bak 备份，最后替换为新文件
+        """
+        content = dumps_json(save_data)
+        tmp_file = self.data_file.with_suffix(".json.tmp")
+        with open(tmp_file, "wb") as f:
+            f.write(content)
+            # 替换前确保数据已落盘，避免断电后留下空文件
+            f.flush()
+            os.fsync(f.fileno())
+        # 创建备份文件（硬链接不复制数据，不支持时退回复制）
+        if self.data_file.exists():
+            backup_file = self.data_file.with_suffix(".json.bak")
+            if backup_file.exists():
+                backup_file.unlink()
+            try:
+                os.link(self.data_file, backup_file)
+            except OSError:
+                shutil.copyfile(self.data_file, backup_file)
+        os.replace(tmp_file, self.data_file)
+
     def get_all_endings(self) -> list[DoroEnding]:
         """获取所有结局数据"""
         return self._data["datas"]
 
+    @property
+    def sorted_endings(self) -> tuple[DoroEnding, ...]:
+        """按ID排序的结局元组，仅在增删结局后重建"""
+        if self._sorted_cache is None:
+            self._sorted_cache = tuple(
+                sorted(self._data["datas"], key=operator.attrgetter("id"))
+            )
+        return self._sorted_cache
+
+    @property
+    def total(self) -> int:
+        """结局总数"""
+        return self._data["total"]
+
+    @property
+    def version(self) -> int:
+        """数据版本号，可用于判断外部缓存是否过期"""
+        return self._version
+
     def get_ending_by_id(self, ending_id: int) -> Optional[DoroEnding]:
         """根据ID获取结局"""
-        for ending in self._data["datas"]:
-            if ending.id == ending_id:
-                return ending
-        return None
+        return self._by_id.get(ending_id)
 
     def get_ending_by_name(self, name: str) -> Optional[DoroEnding]:
         """根据中文名获取结局"""
-        for ending in self._data["datas"]:
-            if ending.name == name:
-                return ending
-        return None
+        return self._by_name.get(name)
 
     def search_endings(self, keyword: str) -> list[DoroEnding]:
         """搜索结局（支持中文名和英文名模糊搜索）"""
         keyword = keyword.lower()
         return [
-            ending for ending in self._data["datas"]
-            if (
-                keyword in ending.name.lower() or
-                keyword in ending.english_name.lower()
-            )
+            ending for ending, name_lc, english_name_lc in self._search_index.values()
+            if keyword in name_lc or keyword in english_name_lc
         ]
 
     def _sanitize_filename(self, filename: str) -> str:
         """清理文件名，移除非法字符"""
         # 移除非法文件名字符
-        filename = re.sub(r'[<>:"/\\|?*]', "_", filename)
+        filename = filename.translate(_ILLEGAL_FILENAME_TRANS)
         # 限制长度
         if len(filename) > self.image_config.max_filename_length:
             # 使用 Path 对象的方法
@@ -209,8 +409,8 @@ class DoroEndingManager:
 
     def _detect_image_extension(self, image_bytes: bytes) -> str:
         """检测图片字节数据的格式并返回对应扩展名"""
-        # 使用imghdr检测图片格式
-        image_format = imghdr.what(None, image_bytes)
+        # 通过文件头魔数检测图片格式
+        image_format = sniff_image_format(image_bytes)
         if image_format:
             # 映射到标准扩展名
             format_to_ext = {
@@ -224,53 +424,203 @@ class DoroEndingManager:
             return format_to_ext.get(image_format, ".jpg")
         return ".jpg"  # 默认扩展名
 
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """获取复用的HTTP会话（首次使用时创建）"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.image_config.max_connections,
+                    ttl_dns_cache=300
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.image_config.timeout)
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """关闭HTTP会话"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
     async def _download_and_save_image(
         self,
         image_url: str,
         save_path: Path
-    ) -> bool:
-        """下载并保存图片，返回是否成功"""
+    ) -> Optional[tuple[Path, str]]:
+        """下载并保存图片，返回 (实际保存的路径, 图片内容的sha256)，失败时返回None"""
         try:
+            session = await self._get_session()
             # 使用单个 async with 语句管理多个上下文
             async with (
-                aiohttp.ClientSession() as session,
-                session.get(
-                    image_url,
-                    timeout=aiohttp.ClientTimeout(total=self.image_config.timeout)
-                ) as response
+                self._download_semaphore,
+                session.get(image_url) as response
             ):
                 response.raise_for_status()
                 # 检查文件大小
                 content_length = response.headers.get("Content-Length")
                 if content_length and int(content_length) > self.image_config.max_size:
                     logger.warning(f"图片文件过大: {content_length} bytes")
-                    return False
-                # 读取数据
-                image_bytes = await response.read()
-                # 检查实际大小
-                if len(image_bytes) > self.image_config.max_size:
-                    logger.warning(f"图片文件过大: {len(image_bytes)} bytes")
-                    return False
-                # 根据Content-Type或字节数据检测扩展名
-                #content_type = response.headers.get("Content-Type", "").lower()
-                #if content_type in self.image_config.content_type_to_ext:
-                #    ext = self.image_config.content_type_to_ext[content_type]
-                #else:
-                #    ext = self._detect_image_extension(image_bytes)
+                    return None
+                chunks = response.content.iter_chunked(64 * 1024)
+                first_chunk = b""
+                # 优先根据Content-Type确定扩展名，未命中时再读取首个数据块检测
+                content_type = response.headers.get("Content-Type", "")
+                content_type = content_type.split(";", 1)[0].strip().lower()
+                ext = self.image_config.content_type_to_ext.get(content_type)
+                if ext is None:
+                    first_chunk = await anext(chunks, b"")
+                    ext = self._detect_image_extension(first_chunk)
                 # 确保扩展名在允许的列表中
-                #if ext not in self.image_config.allowed_extensions:
-                #    logger.warning(f"不支持的图片格式: {ext}")
-                #    return False
-                # 修改保存路径的扩展名
-                #save_path = save_path.with_suffix(ext)
-                # 保存文件
-                async with await anyio.open_file(save_path.with_suffix(".jpg"), "wb") as img_file:
-                    await img_file.write(image_bytes)
-                logger.debug(f"图片已保存: {save_path.name}")
-                return True
+                if ext not in self.image_config.allowed_extensions:
+                    logger.warning(f"不支持的图片格式: {ext}")
+                    return None
+                # 边下载边写入文件，不在内存中缓存整张图片
+                target_path = save_path.with_suffix(ext)
+                written = len(first_chunk)
+                # 数据块先在内存中累积，达到 WRITE_BATCH_SIZE 后再一次性写入，
+                # 减少切换到工作线程的次数
+                batch: list[bytes] = [first_chunk] if first_chunk else []
+                batch_size = written
+                # 边下载边计算哈希，用于检测重复图片
+                hasher = hashlib.sha256(first_chunk)
+                try:
+                    img_file = await anyio.to_thread.run_sync(open, target_path, "wb")
+                    try:
+                        async for chunk in chunks:
+                            written += len(chunk)
+                            # 检查实际大小
+                            if written > self.image_config.max_size:
+                                break
+                            batch.append(chunk)
+                            batch_size += len(chunk)
+                            hasher.update(chunk)
+                            if batch_size >= WRITE_BATCH_SIZE:
+                                await anyio.to_thread.run_sync(img_file.writelines, batch)
+                                batch = []
+                                batch_size = 0
+                        if batch and written <= self.image_config.max_size:
+                            await anyio.to_thread.run_sync(img_file.writelines, batch)
+                    finally:
+                        await anyio.to_thread.run_sync(img_file.close)
+                except BaseException:
+                    # 下载中断，删除写了一半的文件
+                    target_path.unlink(missing_ok=True)
+                    raise
+                if written > self.image_config.max_size:
+                    target_path.unlink(missing_ok=True)
+                    logger.warning(f"图片文件过大: 超过 {self.image_config.max_size} bytes")  # noqa: E501
+                    return None
+                logger.debug(f"图片已保存: {target_path.name}")
+                return target_path, hasher.hexdigest()
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logger.error(f"下载图片失败 {image_url}: {e}")
-            return False
+            return None
+
+    async def _save_ending_image(
+        self,
+        ending_id: int,
+        english_name: str,
+        image_url: Optional[str] = None,
+        image_bytes: Optional[bytes] = None
+    ) -> tuple[str, str]:
+        """
+        保存结局图片，返回 (图片文件名, 图片内容的sha256)
+        没有图片时均为空字符串
+        """
+        if not (image_url or image_bytes):
+            return "", ""
+        # 清理英文名用于文件名
+        safe_english_name = self._sanitize_filename(english_name)
+        pic_path = self.pic_dir / f"{ending_id:08d}_{safe_english_name}"
+        pic_filename = ""
+        digest = ""
+        try:
+            if image_bytes:
+                # 检查字节数据大小
+                if len(image_bytes) > self.image_config.max_size:
+                    self._raise_value_error(
+                        self.FILE_TOO_LARGE_MSG,
+                        self.image_config.max_size
+                    )
+                # 检测图片格式
+                #ext = self._detect_image_extension(image_bytes)
+                #if ext not in self.image_config.allowed_extensions:
+                #   self._raise_value_error(
+                #        self.UNSUPPORTED_FORMAT_MSG,
+                #        self.image_config.allowed_extensions
+                #    )
+                #pic_path = pic_path.with_suffix(ext)
+                pic_filename = pic_path.name + ".jpg"
+                # 直接保存字节数据（打开、写入、关闭只占用一次线程调度）
+                await anyio.to_thread.run_sync(
+                    (self.pic_dir / pic_filename).write_bytes, image_bytes
+                )
+                digest = hashlib.sha256(image_bytes).hexdigest()
+                logger.debug(f"图片已保存: {pic_filename}")
+            elif image_url:
+                # 从URL下载图片
+                saved = await self._download_and_save_image(image_url, pic_path)
+                if saved is None:
+                    raise RuntimeError("图片下载失败")
+                # 使用实际保存的文件名（扩展名由图片格式决定）
+                saved_path, digest = saved
+                pic_filename = saved_path.name
+        except (OSError, aiohttp.ClientError, ValueError, RuntimeError) as e:
+            logger.error(f"图片保存失败: {e}")
+            # 如果图片保存失败，抛出异常
+            self._raise_value_error(
+                self.SAVE_FAILED_MSG,
+                e
+            )
+        return pic_filename, digest
+
+    @staticmethod
+    def _hash_image_file(path: Path) -> Optional[str]:
+        """计算图片文件内容的sha256（同步执行，需在工作线程中调用），文件不存在时返回None"""
+        hasher = hashlib.sha256()
+        try:
+            with open(path, "rb") as f:
+                while chunk := f.read(HASH_CHUNK_SIZE):
+                    hasher.update(chunk)
+        except OSError:
+            return None
+        return hasher.hexdigest()
+
+    def _hash_image_files(self, pics: dict[int, str]) -> dict[int, str]:
+        """计算多个结局图片的sha256（同步执行，需在工作线程中调用），跳过无法读取的文件"""
+        hashes = {}
+        for ending_id, pic in pics.items():
+            digest = self._hash_image_file(self.pic_dir / pic)
+            if digest is not None:
+                hashes[ending_id] = digest
+        return hashes
+
+    async def _ensure_pic_hash_index(self) -> None:
+        """建立图片内容哈希索引（仅首次调用时计算，计算期间不持有内存锁）"""
+        async with self._hash_index_lock:
+            if self._pic_hashes is not None:
+                return
+            async with self._lock:
+                pics = {ending.id: ending.pic for ending in self._data["datas"] if ending.pic}
+            # 将图片分成若干组，在多个工作线程中并行计算
+            items = list(pics.items())
+            step = max(1, -(-len(items) // HASH_WORKERS))
+            hashes: dict[int, str] = {}
+            for part in await asyncio.gather(*(
+                anyio.to_thread.run_sync(self._hash_image_files, dict(items[i:i + step]))
+                for i in range(0, len(items), step)
+            )):
+                hashes.update(part)
+            async with self._lock:
+                # 计算期间被删除的结局不再计入索引
+                self._hash_by_id = {
+                    ending_id: digest for ending_id, digest in hashes.items()
+                    if ending_id in self._by_id
+                }
+                self._pic_hashes = {}
+                for ending_id, digest in self._hash_by_id.items():
+                    self._pic_hashes.setdefault(digest, ending_id)
+            logger.debug(f"已建立图片哈希索引: {len(self._pic_hashes)} 张图片")
 
     async def add_ending(
         self,
@@ -279,112 +629,131 @@ class DoroEndingManager:
         image_url: Optional[str] = None,
         image_bytes: Optional[bytes] = None
     ) -> Optional[DoroEnding]:
-        """添加新的doro结局"""
-        async with self._lock:  # 加锁保护整个添加过程
-            # 检查名称是否已存在
-            if self.get_ending_by_name(name):
+        """添加新的doro结局（下载和保存图片期间不持有锁）"""
+        async with self._lock:  # 加锁检查名称并预留ID
+            # 检查名称是否已存在（包括正在添加中的结局）
+            if self.get_ending_by_name(name) or name in self._pending:
                 raise ValueError(self.DUPLICATE_NAME_MSG.format(name))
-            # 生成新的ID
+            # 生成新的ID并立即占用，避免并发添加拿到相同ID
             new_id = self._data["max_id"] + 1
-            # 处理图片
-            pic_filename = ""
+            self._data["max_id"] = new_id
+            self._pending[name] = new_id
+        try:
+            # 处理图片（首次添加图片时先建立哈希索引，用于检测重复图片）
             if image_url or image_bytes:
-                # 清理英文名用于文件名
-                safe_english_name = self._sanitize_filename(english_name)
-                pic_filename = f"{new_id:08d}_{safe_english_name}"
-                pic_path = self.pic_dir / pic_filename
-                try:
-                    if image_bytes:
-                        # 检查字节数据大小
-                        if len(image_bytes) > self.image_config.max_size:
-                            self._raise_value_error(
-                                self.FILE_TOO_LARGE_MSG,
-                                self.image_config.max_size
-                            )
-                        # 检测图片格式
-                        #ext = self._detect_image_extension(image_bytes)
-                        #if ext not in self.image_config.allowed_extensions:
-                        #   self._raise_value_error(
-                        #        self.UNSUPPORTED_FORMAT_MSG,
-                        #        self.image_config.allowed_extensions
-                        #    )
-                        #pic_path = pic_path.with_suffix(ext)
-                        pic_filename = pic_path.name + ".jpg"
-                        # 直接保存字节数据
-                        async with await anyio.open_file(pic_path, "wb") as img_file:
-                            await img_file.write(image_bytes)
-                        logger.debug(f"图片已保存: {pic_filename}")
-                    elif image_url:
-                        # 从URL下载图片
-                        success = await self._download_and_save_image(image_url, pic_path)  # noqa: E501
-                        if success:
-                            # 获取实际保存的文件名（可能扩展名已改变）
-                            pic_filename = pic_path.with_suffix("").name + ".jpg"
-                            # 查找实际保存的文件
-                            #for ext in self.image_config.allowed_extensions:
-                            #    actual_path = pic_path.with_suffix(ext)
-                            #    if actual_path.exists():
-                            #        pic_filename = actual_path.name
-                            #        break
-                        else:
-                            raise RuntimeError("图片下载失败")
-                except (OSError, aiohttp.ClientError, ValueError) as e:
-                    logger.error(f"图片保存失败: {e}")
-                    # 如果图片保存失败，抛出异常
-                    self._raise_value_error(
-                        self.SAVE_FAILED_MSG,
-                        e
-                    )
-            # 创建新的结局对象
-            new_ending = DoroEnding(
-                id=new_id,
-                name=name,
-                english_name=english_name,
-                pic=pic_filename
+                await self._ensure_pic_hash_index()
+            pic_filename, digest = await self._save_ending_image(
+                new_id, english_name, image_url, image_bytes
             )
-            # 添加到内存数据
-            self._data["datas"].append(new_ending)
-            self._data["max_id"] = new_id
-            self._data["total"] += 1
-            self._dirty = True
-            logger.info(f"已添加新结局: {name} (ID: {new_id})")
-            return new_ending
+        except BaseException:
+            # 图片保存失败，释放预留的名称和ID
+            del self._pending[name]
+            if self._data["max_id"] == new_id:
+                self._data["max_id"] = new_id - 1
+            raise
+        async with self._lock:  # 加锁写入内存数据
+            del self._pending[name]
+            duplicate_id = None
+            if digest and self._pic_hashes is not None:
+                duplicate_id = self._pic_hashes.get(digest)
+            if duplicate_id is not None:
+                # 图片已存在，释放预留的ID
+                if self._data["max_id"] == new_id:
+                    self._data["max_id"] = new_id - 1
+            else:
+                new_ending = self._insert_ending(
+                    new_id, name, english_name, pic_filename, digest
+                )
+        if duplicate_id is not None:
+            # 删除刚保存的重复图片（不持有锁）
+            await anyio.to_thread.run_sync(
+                functools.partial((self.pic_dir / pic_filename).unlink, missing_ok=True)
+            )
+            logger.warning(f"图片与ID为 {duplicate_id} 的结局重复，已放弃添加: {name}")
+            raise ValueError(self.DUPLICATE_IMAGE_MSG.format(duplicate_id))
+        return new_ending
+
+    def _insert_ending(
+            self,
+            new_id: int,
+            name: str,
+            english_name: str,
+            pic_filename: str,
+            digest: str
+            ) -> DoroEnding:
+        """创建结局并写入内存数据和索引（调用方需持有内存锁）"""
+        # 创建新的结局对象
+        new_ending = DoroEnding(
+            id=new_id,
+            name=name,
+            english_name=english_name,
+            pic=pic_filename
+        )
+        # 添加到内存数据
+        self._data["datas"].append(new_ending)
+        self._index_ending(new_ending)
+        if digest and self._pic_hashes is not None:
+            self._pic_hashes[digest] = new_id
+            self._hash_by_id[new_id] = digest
+        self._data["total"] += 1
+        self._sorted_cache = None
+        self._version += 1
+        self._dirty = True
+        logger.info(f"已添加新结局: {name} (ID: {new_id})")
+        return new_ending
 
     async def remove_ending(self, target: Any) -> bool:
-        """删除doro结局（支持ID或中文名）"""
-        async with self._lock:  # 加锁保护
-            ending = None
-            # 根据类型查找
-            if isinstance(target, int):
-                ending = self.get_ending_by_id(target)
-            elif isinstance(target, str):
-                if target.isdigit():
-                    ending = self.get_ending_by_id(int(target))
-                else:
-                    ending = self.get_ending_by_name(target)
+        """删除doro结局（支持ID或中文名），已知类型时请直接调用对应方法"""
+        try:
+            ending_id = int(target)
+        except (TypeError, ValueError):
+            return await self.remove_ending_by_name(target)
+        return await self.remove_ending_by_id(ending_id)
+
+    async def remove_ending_by_id(self, ending_id: int) -> bool:
+        """根据ID删除doro结局"""
+        return await self._remove_ending(self._by_id.get, ending_id)
+
+    async def remove_ending_by_name(self, name: str) -> bool:
+        """根据中文名删除doro结局"""
+        return await self._remove_ending(self._by_name.get, name)
+
+    async def _remove_ending(
+            self,
+            lookup: Callable[[Any], Optional[DoroEnding]],
+            key: Any
+            ) -> bool:
+        """删除 lookup(key) 找到的结局，删除图片文件时不持有锁"""
+        async with self._lock:  # 加锁保护内存数据
+            ending = lookup(key)
             if not ending:
                 return False
+            # 从内存中删除
+            self._data["datas"].remove(ending)
+            self._unindex_ending(ending)
+            # 图片哈希只在删除时移除（更新名称时图片不变，保留哈希）
+            digest = self._hash_by_id.pop(ending.id, None)
+            if digest is not None and self._pic_hashes is not None:
+                self._pic_hashes.pop(digest, None)
+            self._data["total"] -= 1
+            # max_id 只增不减：正在添加中的结局可能已预留更大的ID，回退会导致ID重复
+            self._sorted_cache = None
+            self._version += 1
+            self._dirty = True
+            logger.info(f"已删除结局: {ending.name} (ID: {ending.id})")
+        # 删除图片文件
+        if ending.pic:
+            pic_path = self.pic_dir / ending.pic
             try:
-                # 删除图片文件
-                if ending.pic:
-                    pic_path = self.pic_dir / ending.pic
-                    if await anyio.Path(pic_path).exists():
-                        await anyio.Path(pic_path).unlink()
-                        logger.info(f"已删除图片文件: {pic_path}")
-                # 从内存中删除
-                self._data["datas"].remove(ending)
-                self._data["total"] -= 1
-                # 如果删除的是最大ID的条目，重新计算max_id
-                if ending.id == self._data["max_id"] and self._data["datas"]:
-                    self._data["max_id"] = max(item.id for item in self._data["datas"])
-                elif not self._data["datas"]:
-                    self._data["max_id"] = 0
-                self._dirty = True
-                logger.info(f"已删除结局: {ending.name} (ID: {ending.id})")
+                # 直接删除，文件不存在时忽略，只需一次线程调度
+                await anyio.to_thread.run_sync(os.unlink, pic_path)
+                logger.info(f"已删除图片文件: {pic_path}")
+            except FileNotFoundError:
+                pass
             except OSError as e:
-                logger.error(f"删除结局失败: {e}")
-                return False
-            return True
+                # 记录已删除，残留的图片可由 cleanup_images 清理
+                logger.error(f"删除图片文件失败: {e}")
+        return True
 
     async def update_ending(
             self,
@@ -399,24 +768,20 @@ class DoroEndingManager:
                 logger.warning(f"未找到ID为 {target} 的结局")
                 # 抛出异常，表示未找到ID
                 raise ValueError(self.NOT_FOUND_ID_MSG.format(target))
-            # 检查名称冲突
-            field_mapping = {
-                "name": ("name", self.DUPLICATE_CHINESE_NAME_MSG),
-                "english_name": ("english_name", self.DUPLICATE_ENGLISH_NAME_MSG)
-            }
-            for field, (attr_name, error_msg) in field_mapping.items():
-                if field in kwargs and kwargs[field] != getattr(ending, field):
+            # 检查名称冲突（每个字段一次字典查询）
+            for field, getter, index_attr, error_msg, label in self._UNIQUE_FIELDS:
+                if field in kwargs and kwargs[field] != getter(ending):
                     new_value = kwargs[field]
                     # 检查是否有其他结局使用相同的名称
-                    for e in self._data["datas"]:
-                        if e.id != target and getattr(e, attr_name) == new_value:
-                            logger.error(
-                                f"{'中文名' if field == 'name' else '英文名'}"
-                                f"'{new_value}' 已存在")
-                            raise ValueError(error_msg.format(new_value))
-            # 应用更新
+                    existing = getattr(self, index_attr).get(new_value)
+                    if existing is not None and existing.id != target:
+                        logger.error(f"{label}'{new_value}' 已存在")
+                        raise ValueError(error_msg.format(new_value))
+            # 应用更新（先移出索引，更新后按新值重新加入）
+            changes = tuple(kwargs.items())
+            self._unindex_ending(ending)
             updated = False
-            for key, value in kwargs.items():
+            for key, value in changes:
                 if hasattr(ending, key):
                     old_value = getattr(ending, key)
                     if old_value != value:
@@ -424,8 +789,10 @@ class DoroEndingManager:
                         updated = True
                 else:
                     logger.warning(f"跳过不存在的字段: {key}")
+            self._index_ending(ending)
             # 标记脏数据
             if updated:
+                self._version += 1
                 self._dirty = True
                 logger.info(f"已更新结局 '{ending.name}' (ID: {ending.id})")
             return ending
@@ -435,72 +802,110 @@ class DoroEndingManager:
         return {
             "total": self._data["total"],
             "max_id": self._data["max_id"],
-            "with_images": len([e for e in self._data["datas"] if e.pic]),
-            "without_images": len([e for e in self._data["datas"] if not e.pic])
+            "with_images": self._with_images,
+            "without_images": len(self._by_id) - self._with_images
         }
 
+    def _list_image_files(self) -> list[str]:
+        """列出图片目录中的所有文件名（同步执行，需在工作线程中调用）"""
+        with os.scandir(self.pic_dir) as entries:
+            return [entry.name for entry in entries if entry.is_file()]
+
+    def _unlink_many(
+        self, image_names: list[str]
+    ) -> tuple[list[str], list[tuple[str, str]]]:
+        """批量删除图片文件（同步执行，需在工作线程中调用）
+
+        返回 (成功删除的文件名列表, [(失败的文件名, 错误信息)])
+        """
+        cleaned = []
+        failed = []
+        for image_name in image_names:
+            try:
+                os.unlink(self.pic_dir / image_name)
+            except OSError as e:
+                failed.append((image_name, str(e)))
+            else:
+                cleaned.append(image_name)
+        return cleaned, failed
+
+    async def find_missing_images(self) -> list[DoroEnding]:
+        """查找图片文件不存在的结局（一次列出目录，无需逐个检查文件）"""
+        existing = set(await anyio.to_thread.run_sync(self._list_image_files))
+        async with self._lock:
+            return [
+                ending for ending in self.sorted_endings
+                if ending.pic and ending.pic not in existing
+            ]
+
     async def cleanup_images(self) -> list[str]:
         """清理无用的图片文件（没有对应记录的图片）"""
-        async with self._lock:  # 加锁保护
+        async with self._lock:  # 仅在收集正在使用的图片时加锁
             used_images = {ending.pic for ending in self._data["datas"] if ending.pic}
-            # 获取所有图片文件
-            pic_dir_path = anyio.Path(self.pic_dir)
-            all_images = set()
-            async for f in pic_dir_path.iterdir():
-                if await f.is_file():
-                    all_images.add(f.name)
-            unused_images = list(all_images - used_images)
-            cleaned = []
-            failed_deletions = []
-            # 遍历一次，收集所有要删除的文件路径
-            to_delete = [pic_dir_path / image_name for image_name in unused_images]
-            # 批量删除
-            for image_path in to_delete:
-                try:
-                    await image_path.unlink()
-                    cleaned.append(image_path.name)
-                    logger.debug(f"清理图片: {image_path.name}")
-                except OSError as e:  # noqa: PERF203
-                    failed_deletions.append((image_path.name, str(e)))
-            # 统一记录失败信息（避免每次失败都记录日志的开销）
-            if failed_deletions:
-                for image_name, error in failed_deletions:
-                    logger.error(f"清理图片失败 {image_name}: {error}")
-                logger.warning(f"成功清理 {len(cleaned)} 个文件，{len(failed_deletions)} 个文件清理失败")  # noqa: E501
-            else:
-                logger.info(f"已清理 {len(cleaned)} 个无用图片文件")
-            return cleaned
+            # 正在添加中的结局的图片也不能清理
+            pending_prefixes = tuple(
+                f"{pending_id:08d}_" for pending_id in self._pending.values()
+            )
+        # 获取所有图片文件（scandir 直接使用目录项中的类型信息，无需逐个 stat）
+        all_images = set(await anyio.to_thread.run_sync(self._list_image_files))
+        unused_images = [
+            image_name for image_name in all_images - used_images
+            if not image_name.startswith(pending_prefixes)
+        ]
+        # 在一个工作线程中批量删除，避免每个文件单独调度一次线程
+        cleaned, failed_deletions = await anyio.to_thread.run_sync(
+            self._unlink_many, unused_images
+        )
+        for image_name in cleaned:
+            logger.debug(f"清理图片: {image_name}")
+        # 统一记录失败信息（避免每次失败都记录日志的开销）
+        if failed_deletions:
+            for image_name, error in failed_deletions:
+                logger.error(f"清理图片失败 {image_name}: {error}")
+            logger.warning(f"成功清理 {len(cleaned)} 个文件，{len(failed_deletions)} 个文件清理失败")  # noqa: E501
+        else:
+            logger.info(f"已清理 {len(cleaned)} 个无用图片文件")
+        return cleaned
+
+    @staticmethod
+    def _inspect_image_file(path: Path) -> tuple[int, bytes]:
+        """一次打开文件取得大小和前32字节（同步执行，需在工作线程中调用）"""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            return os.fstat(fd).st_size, os.read(fd, 32)
+        finally:
+            os.close(fd)
 
     async def validate_image_file(self, ending_id: int) -> dict[str, Any]:  # noqa: PLR0911
         """验证图片文件是否存在且格式正确"""
-        async with self._lock:  # 加锁保护
+        async with self._lock:  # 仅在查找结局时加锁，读取文件时不持有
             ending = self.get_ending_by_id(ending_id)
             if not ending:
                 return {"valid": False, "error": f"未找到ID为 {ending_id} 的结局"}
             if not ending.pic:
                 return {"valid": False, "error": "该结局没有关联的图片"}
             pic_path = self.pic_dir / ending.pic
-            if not await anyio.Path(pic_path).exists():
-                return {"valid": False, "error": f"图片文件不存在: {pic_path}"}
-            try:
-                # 检查文件大小
-                stat = await anyio.Path(pic_path).stat()
-                if stat.st_size > self.image_config.max_size:
-                    return {
-                        "valid": False, 
-                        "error": f"图片文件过大: {stat.st_size} bytes"
-                    }
-                # 检查文件格式
-                async with await anyio.open_file(pic_path, "rb") as f:
-                    header = await f.read(32)  # 读取前32字节用于检测
-                detected_format = imghdr.what(None, header)
-                if not detected_format:
-                    return {"valid": False, "error": "无法识别图片格式"}
-                return {
-                    "valid": True,
-                    "file_size": stat.st_size,
-                    "format": detected_format,
-                    "path": str(pic_path)
-                }
-            except OSError as e:
-                return {"valid": False, "error": f"检查图片文件失败: {e}"}
\ No newline at end of file
+        try:
+            # 大小和文件头在同一次线程调度中取得（open 同时判断文件是否存在）
+            file_size, header = await anyio.to_thread.run_sync(
+                self._inspect_image_file, pic_path
+            )
+        except FileNotFoundError:
+            return {"valid": False, "error": f"图片文件不存在: {pic_path}"}
+        except OSError as e:
+            return {"valid": False, "error": f"检查图片文件失败: {e}"}
+        if file_size > self.image_config.max_size:
+            return {
+                "valid": False, 
+                "error": f"图片文件过大: {file_size} bytes"
+            }
+        # 检查文件格式
+        detected_format = sniff_image_format(header)
+        if not detected_format:
+            return {"valid": False, "error": "无法识别图片格式"}
+        return {
+            "valid": True,
+            "file_size": file_size,
+            "format": detected_format,
+            "path": str(pic_path)
+        }
\ No newline at end of file
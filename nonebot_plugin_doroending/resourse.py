@@ -1,17 +1,44 @@
-import json
+import asyncio
+import functools
+import hashlib
+import os
+import random
 import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Literal
+from typing import Any, Awaitable, Callable, Literal, Optional
+from urllib.parse import urlsplit
 
-import requests
+import aiohttp
+import anyio
 from nonebot import logger
 from nonebot.plugin import get_plugin_config
 
-from .model import Config
+from .model import Config, dumps_json, loads_json
 
 config = get_plugin_config(Config)
 
+# 流式下载时每次读取的数据块大小
+CHUNK_SIZE = 64 * 1024
+# 累积到该大小（或 WRITE_BATCH_CHUNKS 个数据块）后再一次性写入磁盘
+WRITE_BATCH_SIZE = 1024 * 1024
+WRITE_BATCH_CHUNKS = 64
+# 记录已下载文件ETag的文件名（位于下载目录中）
+ETAG_FILE_NAME = ".etags.json"
+# 记录已下载文件git blob SHA的文件名（位于下载目录中）
+BLOB_SHA_FILE_NAME = ".blobs.json"
+# 记录上次成功使用的源的文件名（位于下载目录中）及其有效期（秒）
+SOURCE_PREFERENCE_FILE_NAME = ".source_preference.json"
+SOURCE_PREFERENCE_TTL = 24 * 60 * 60
+# 可重试的HTTP状态码（超时、速率限制和服务器临时错误）
+RETRY_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+# 可重试状态码和速率限制（403）的最大重试次数
+MAX_RETRIES = 3
+
+# 仓库文件列表缓存 {API地址: (获取时间, {文件路径: blob SHA})}
+# 放在模块级别，同一进程中多次下载（每次创建新的下载器）时可以复用
+_tree_cache: dict[str, tuple[float, dict[str, str]]] = {}
+
 
 @dataclass
 class DownloadResult:
@@ -23,6 +50,97 @@ class DownloadResult:
     local_path: Optional[Path] = None
 
 
+def _open_for_write(path: Path, size: Optional[int]) -> int:
+    """
+    创建并打开文件用于写入，返回文件描述符（同步执行，需在工作线程中调用）
+    已知文件大小时预先分配磁盘空间，减少写入过程中的空间分配
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass  # 文件系统不支持预分配时直接写入
+    return fd
+
+
+def _write_chunks(fd: int, chunks: list[bytes]) -> None:
+    """
+    将多个数据块完整写入文件描述符（同步执行，需在工作线程中调用）
+    支持 writev 时一次系统调用写入所有数据块，无需先拼接
+    """
+    views = [memoryview(chunk) for chunk in chunks]
+    index = 0
+    while index < len(views):
+        if hasattr(os, "writev"):
+            written = os.writev(fd, views[index:])
+        else:
+            written = os.write(fd, views[index])
+        # 跳过已完整写入的数据块，部分写入的数据块保留剩余部分
+        while index < len(views) and written >= len(views[index]):
+            written -= len(views[index])
+            index += 1
+        if written:
+            views[index] = views[index][written:]
+
+
+class HostThrottle:
+    """
+    单个主机的令牌桶限速器
+    根据响应头中的 X-RateLimit-* 信息调整速率，额度用尽时等待到重置时间
+    没有收到速率限制信息之前不做限制
+    """
+    def __init__(self, burst: int = 10):
+        self.burst = burst
+        self.tokens: float = burst
+        self.rate: Optional[float] = None  # 每秒可用的请求数，None 表示不限速
+        self.last = time.monotonic()
+        self.blocked_until = 0.0  # 额度用尽时，恢复请求的时间点
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        pass
+
+    async def acquire(self) -> None:
+        """获取一个令牌，必要时等待"""
+        if self.rate is None and self.blocked_until <= time.monotonic():
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self.blocked_until > now:
+                await asyncio.sleep(self.blocked_until - now)
+                now = time.monotonic()
+            if self.rate is None:
+                return
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 0
+                self.last = time.monotonic()
+            else:
+                self.tokens -= 1
+
+    def update(self, headers: Any) -> None:
+        """根据响应头更新速率：剩余额度平均分配到重置前的时间内"""
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining_count = int(remaining)
+            reset_in = float(reset) - time.time()
+        except ValueError:
+            return
+        if remaining_count <= 0:
+            self.blocked_until = time.monotonic() + max(reset_in, 0)
+        else:
+            self.rate = remaining_count / max(reset_in, 1)
+
+
 class GitRepoDownloader:
     """Git仓库资源下载器（支持GitHub和Gitee）"""
     def __init__(
@@ -34,7 +152,9 @@ class GitRepoDownloader:
         token: str = "",
         use_gitee_fallback: bool = True,
         gitee_owner: str = "seewhy_ran",
-        gitee_repo: str = "doroending_pic_assets"
+        gitee_repo: str = "doroending_pic_assets",
+        max_concurrency: int = 64,
+        cache_ttl: float = 300
     ):
         self.repo_owner = repo_owner
         self.repo_name = repo_name
@@ -44,6 +164,20 @@ class GitRepoDownloader:
         self.use_gitee_fallback = use_gitee_fallback
         self.gitee_owner = gitee_owner
         self.gitee_repo = gitee_repo
+        self.max_concurrency = max_concurrency
+        self.cache_ttl = cache_ttl
+        # 复用的HTTP会话（连接池），首次请求时创建
+        self._session: Optional[aiohttp.ClientSession] = None
+        # 限制同时进行的文件下载数
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # 每个主机各自的限速器
+        self._throttles: dict[str, HostThrottle] = {}
+        # 已下载文件的ETag {相对路径: ETag}，用于条件请求
+        self._etags: dict[str, str] = {}
+        self._etags_dirty = False
+        # 已下载文件的git blob SHA {相对路径: SHA}，与仓库文件列表中的SHA一致时无需请求
+        self._blob_shas: dict[str, str] = {}
+        self._blob_shas_dirty = False
         # 当前使用的源
         self.current_source: Literal["github", "gitee"] = "github"
         # 初始化URL
@@ -51,76 +185,217 @@ class GitRepoDownloader:
         # 统计信息
         self.downloaded_files = 0
         self.skipped_files = 0
+        # 已计入下载或跳过统计的文件（相对路径），避免切换源重试时重复计数
+        self._counted_paths: set[str] = set()
         self.failed_files = 0
 
+    async def __aenter__(self) -> "GitRepoDownloader":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """获取复用的HTTP会话（首次使用时创建），公共请求头只设置一次"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency * 2,
+                    limit_per_host=self.max_concurrency,
+                    keepalive_timeout=30,
+                    ttl_dns_cache=300
+                ),
+                # 只限制建立连接和每次读取的时间，不限制整个请求的总时长，
+                # 避免大文件在慢速网络下仍在传输时被中断
+                timeout=aiohttp.ClientTimeout(
+                    total=None, sock_connect=self.timeout, sock_read=self.timeout
+                ),
+                headers={'User-Agent': 'DoroEndingDownloader/1.0'}
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """关闭HTTP会话，释放连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
     def _update_urls(self):
         """根据当前源更新URL"""
         if self.current_source == "github":
-            self.base_api_url = f"https://api.github.com/repos/{self.repo_owner}/{self.repo_name}/contents"
+            self.base_api_url = f"https://api.github.com/repos/{self.repo_owner}/{self.repo_name}"
             self.raw_base_url = f"https://raw.githubusercontent.com/{self.repo_owner}/{self.repo_name}/main"
         else:  # gitee
-            self.base_api_url = f"https://gitee.com/api/v5/repos/{self.gitee_owner}/{self.gitee_repo}/contents"
+            self.base_api_url = f"https://gitee.com/api/v5/repos/{self.gitee_owner}/{self.gitee_repo}"
             self.raw_base_url = f"https://gitee.com/{self.gitee_owner}/{self.gitee_repo}/raw/main"
+        # 文件下载地址的前缀，拼接时只需一次字符串相加
+        self._url_prefix = self.raw_base_url + "/"
 
-    def _switch_to_gitee(self):
-        """切换到Gitee源"""
-        if self.current_source == "gitee":
-            return False  # 已经是Gitee，无需切换
-        logger.warning("GitHub连接失败，尝试切换到Gitee源...")
-        self.current_source = "gitee"
+    def _switch_source(self) -> None:
+        """切换到另一个源（GitHub和Gitee互为备用）"""
+        previous = self.current_source
+        self.current_source = "gitee" if previous == "github" else "github"
+        logger.warning(f"{previous.upper()}连接失败，尝试切换到{self.current_source.upper()}源...")
         self._update_urls()
-        return True
 
-    def _make_request(self, url: str) -> Optional[requests.Response]:
-        """统一的请求方法，添加认证头"""
-        headers = {
-            'User-Agent': 'DoroEndingDownloader/1.0'
-        }
-        # 只在GitHub请求中添加token
+    def _load_source_preference(self) -> Optional[str]:
+        """读取上次成功使用的源，记录不存在或已过期时返回None（同步执行，需在工作线程中调用）"""
+        try:
+            preference = loads_json((self.target_dir / SOURCE_PREFERENCE_FILE_NAME).read_bytes())
+            if time.time() - preference["ts"] < SOURCE_PREFERENCE_TTL:
+                return preference["source"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _save_source_preference(self) -> None:
+        """记录本次成功使用的源（同步执行，需在工作线程中调用）"""
+        (self.target_dir / SOURCE_PREFERENCE_FILE_NAME).write_bytes(
+            dumps_json({"source": self.current_source, "ts": time.time()})
+        )
+
+    async def _make_request(
+        self,
+        url: str,
+        extra_headers: Optional[dict[str, str]] = None
+    ) -> Optional[aiohttp.ClientResponse]:
+        """统一的请求方法，添加认证头（调用方负责通过 async with 释放响应）"""
+        # 只在GitHub请求中添加token，其余请求头由会话统一设置
+        headers = dict(extra_headers) if extra_headers else {}
         if self.current_source == "github" and self.token:
             headers['Authorization'] = f'token {self.token}'
+        headers = headers or None
+        session = await self._get_session()
+        throttle = self._throttles.setdefault(urlsplit(url).netloc, HostThrottle())
         try:
-            response = requests.get(url, headers=headers, timeout=self.timeout)
-            # 检查是否是网络连接问题或GitHub不可用
-            if response.status_code >= 500 or response.status_code == 403:
-                # 403可能是速率限制，500是服务器错误
+            for attempt in range(MAX_RETRIES + 1):
+                async with throttle:
+                    response = await session.get(url, headers=headers)
+                throttle.update(response.headers)
+                status = response.status
+                if (status not in RETRY_CODES and status != 403) or attempt == MAX_RETRIES:
+                    break
+                delay = self._retry_delay(response, attempt)
+                # 不是速率限制，或需要等待太久时，直接交给备用源处理
+                if delay is None or delay > self.timeout:
+                    break
+                response.release()
+                logger.warning(f"{self.current_source.upper()}返回状态码 {status}，{delay:.1f} 秒后重试")
+                await asyncio.sleep(delay)
+            # 重试后仍然失败，交给备用源处理
+            if status in RETRY_CODES or status == 403:
+                # 403可能是速率限制，5xx是服务器错误
+                response.release()
                 if self.use_gitee_fallback:
-                    logger.warning(f"{self.current_source.upper()}返回状态码 {response.status_code}，准备切换到备用源")
+                    logger.warning(f"{self.current_source.upper()}返回状态码 {response.status}，准备切换到备用源")
                 return None
             return response
-        except (requests.ConnectionError, requests.Timeout) as e:
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
             logger.warning(f"连接{self.current_source.upper()}失败: {e}")
             if self.use_gitee_fallback:
                 return None
             raise
 
-    def _download_file(self, url: str, save_path: Path) -> bool:
-        """下载单个文件"""
+    @staticmethod
+    def _retry_delay(response: aiohttp.ClientResponse, attempt: int) -> Optional[float]:
+        """根据 Retry-After 等响应头计算重试前的等待时间，不应重试时返回None"""
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            reset = response.headers.get("X-RateLimit-Reset", "")
+            if reset.isdigit():
+                return max(float(reset) - time.time(), 0)
+        if response.status in RETRY_CODES:
+            # 没有给出等待时间，使用指数退避
+            return 2 ** attempt + random.random()
+        return None
+
+    def _mark_skipped(self, rel_path: str) -> None:
+        """记录跳过的文件，同一文件只计数一次"""
+        if rel_path not in self._counted_paths:
+            self._counted_paths.add(rel_path)
+            self.skipped_files += 1
+
+    async def _download_file(
+        self,
+        url: str,
+        save_path: Path,
+        etag: Optional[str] = None
+    ) -> bool:
+        """
+        下载单个文件（所在目录和本地文件的检查由调用方完成）
+        传入 etag 时发送条件请求，本地文件未变化时跳过
+        """
+        rel_path = save_path.relative_to(self.target_dir).as_posix()
         try:
-            # 如果文件已存在且大小合理，跳过下载
-            if save_path.exists() and save_path.stat().st_size > 100:
-                self.skipped_files += 1
-                logger.debug(f"跳过已存在的文件: {save_path.name}")
-                return True
-            logger.debug(f"正在从{self.current_source.upper()}下载: {save_path.name}")
-            response = self._make_request(url)
-            # 如果请求失败且允许切换到Gitee，则返回False让上层处理
-            if response is None and self.use_gitee_fallback:
-                return False
-            # 如果请求失败且不允许切换源，直接计为失败
-            if response is None:
-                self.failed_files += 1
-                logger.error(f"下载文件失败 {save_path.name}: 无法连接到{self.current_source.upper()}")
-                return False
-            response.raise_for_status()
-            # 确保目录存在
-            save_path.parent.mkdir(parents=True, exist_ok=True)
-            with save_path.open("wb") as f:
-                f.write(response.content)
+            # 调试日志使用参数而不是f-string，未启用DEBUG级别时不会格式化消息
+            logger.debug("正在从{}下载: {}", self.current_source.upper(), save_path.name)
+            async with self._semaphore:
+                response = await self._make_request(
+                    url, {'If-None-Match': etag} if etag else None
+                )
+                # 如果请求失败且允许切换到Gitee，则返回False让上层处理
+                if response is None and self.use_gitee_fallback:
+                    return False
+                # 如果请求失败且不允许切换源，直接计为失败
+                if response is None:
+                    self.failed_files += 1
+                    logger.error(f"下载文件失败 {save_path.name}: 无法连接到{self.current_source.upper()}")
+                    return False
+                async with response:
+                    if response.status == 304:
+                        # 本地文件未变化
+                        self._mark_skipped(rel_path)
+                        logger.debug("文件未修改: {}", save_path.name)
+                        return True
+                    if not 200 <= response.status < 300:
+                        logger.error(f"下载文件失败 {save_path.name}: HTTP状态码 {response.status}")
+                        if not self.use_gitee_fallback:
+                            self.failed_files += 1
+                        return False
+                    # 边下载边写入临时文件，完成后再改名，避免中断时留下不完整的文件
+                    part_path = save_path.with_name(save_path.name + ".part")
+                    try:
+                        fd = await anyio.to_thread.run_sync(
+                            _open_for_write, part_path, response.content_length
+                        )
+                        try:
+                            written = 0
+                            # 分批写入，减少切换到工作线程的次数
+                            batch: list[bytes] = []
+                            batch_size = 0
+                            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                                batch.append(chunk)
+                                batch_size += len(chunk)
+                                if batch_size >= WRITE_BATCH_SIZE or len(batch) >= WRITE_BATCH_CHUNKS:
+                                    await anyio.to_thread.run_sync(_write_chunks, fd, batch)
+                                    written += batch_size
+                                    batch = []
+                                    batch_size = 0
+                            if batch:
+                                await anyio.to_thread.run_sync(_write_chunks, fd, batch)
+                                written += batch_size
+                            # 实际长度与预分配的长度不同时（例如内容经过压缩）截断多余部分
+                            if written != response.content_length:
+                                os.ftruncate(fd, written)
+                        finally:
+                            os.close(fd)
+                        await anyio.Path(part_path).replace(save_path)
+                    except BaseException:
+                        part_path.unlink(missing_ok=True)
+                        raise
+                    new_etag = response.headers.get("ETag")
+            if new_etag:
+                self._etags[rel_path] = new_etag
+            else:
+                self._etags.pop(rel_path, None)
+            self._etags_dirty = True
+            self._counted_paths.add(rel_path)
             self.downloaded_files += 1
-            logger.debug(f"下载成功: {save_path.name}")
+            logger.debug("下载成功: {}", save_path.name)
             return True
-        except requests.RequestException as e:
+        except aiohttp.ClientError as e:
             logger.error(f"下载文件失败 {save_path.name}: {e}")
             if self.use_gitee_fallback:
                 return False
@@ -131,170 +406,325 @@ class GitRepoDownloader:
             self.failed_files += 1
             return False
 
-    def _download_directory(self, dir_path: str, local_base_path: Path) -> bool:
-        """递归下载目录（顺序执行）"""
-        try:
-            # 获取目录内容
-            api_url = f"{self.base_api_url}/{dir_path}"
-            response = self._make_request(api_url)
-            # 如果请求失败且允许切换到Gitee，则返回False让上层处理
+    async def _list_tree(self) -> Optional[dict[str, str]]:
+        """
+        通过 Git Trees API 一次性获取仓库中所有文件的路径
+        Returns:
+            Optional[dict[str, str]]: 需要下载的文件 {路径: blob SHA}，请求失败时返回None
+        """
+        # 缓存在 cache_ttl 秒内有效
+        cached = _tree_cache.get(self.base_api_url)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+            return cached[1]
+        if self.current_source == "github":
+            # GitHub 的 trees 接口可以直接使用分支名
+            tree_sha = "main"
+        else:  # gitee
+            # Gitee 需要先通过分支信息获取提交的SHA
+            response = await self._make_request(f"{self.base_api_url}/branches/main")
             if response is None:
-                return False
-            if response.status_code == 404:
-                logger.warning(f"目录不存在或为空: {dir_path}")
-                return True
-            response.raise_for_status()
-            contents = response.json()
-            # 顺序处理目录中的每个项目
-            for item in contents:
-                item_name = item['name']
-                item_type = item.get('type', 'file')  # Gitee API可能不同
-                # 处理Gitee的API响应格式
-                if 'type' not in item and 'download_url' in item:
-                    item_type = 'file'
-                remote_path = f"{dir_path}/{item_name}" if dir_path else item_name
-                if item_type == 'file':
-                    # 构建下载URL
-                    if self.current_source == "github":
-                        raw_url = f"{self.raw_base_url}/{remote_path}"
-                    else:  # gitee
-                        # Gitee API中可能包含download_url字段
-                        if 'download_url' in item:
-                            raw_url = item['download_url']
-                        else:
-                            raw_url = f"{self.raw_base_url}/{remote_path}"
-                    local_path = local_base_path / item_name
-                    success = self._download_file(raw_url, local_path)
-                    if not success:
-                        return False  # 下载失败，需要切换源
-                elif item_type == 'dir':
-                    # 递归下载子目录
-                    sub_dir_path = local_base_path / item_name
-                    sub_dir_path.mkdir(exist_ok=True)
-                    success = self._download_directory(remote_path, sub_dir_path)
-                    if not success:
-                        return False  # 子目录下载失败，需要切换源
-            return True
-        except Exception as e:
-            logger.error(f"处理目录失败 {dir_path}: {e}")
-            return False
+                return None
+            async with response:
+                if response.status != 200:
+                    logger.error(f"无法获取分支信息，HTTP状态码: {response.status}")
+                    return None
+                tree_sha = (await response.json(content_type=None))["commit"]["sha"]
+        response = await self._make_request(f"{self.base_api_url}/git/trees/{tree_sha}?recursive=1")
+        if response is None:
+            return None
+        async with response:
+            if response.status != 200:
+                logger.error(f"无法访问仓库，HTTP状态码: {response.status}")
+                return None
+            tree = await response.json(content_type=None)
+        if tree.get("truncated"):
+            logger.warning("仓库文件列表被截断，部分文件可能无法下载")
+        # 只保留图片目录中的文件和JSON数据文件
+        paths = {
+            item["path"]: item.get("sha", "") for item in tree.get("tree", [])
+            if item.get("type") == "blob" and (
+                item["path"].startswith("DoroEndingPic/")
+                or item["path"] == "doroendings.json"
+            )
+        }
+        _tree_cache[self.base_api_url] = (time.monotonic(), paths)
+        return paths
 
-    def _download_json_file(self) -> tuple[bool, Optional[dict]]:
+    def _index_local(self) -> dict[str, int]:
+        """
+        遍历一次目标目录，返回 {相对路径: 文件大小}（同步执行，需在工作线程中调用）
+        相对路径使用 / 分隔，与仓库中的路径格式一致
+        """
+        index: dict[str, int] = {}
+        pending = [(str(self.target_dir), "")]
+        while pending:
+            dir_path, prefix = pending.pop()
+            try:
+                entries = os.scandir(dir_path)
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        pending.append((entry.path, f"{prefix}{entry.name}/"))
+                    elif entry.is_file():
+                        index[prefix + entry.name] = entry.stat().st_size
+        return index
+
+    @staticmethod
+    def _make_dirs(dirs: set[Path]) -> None:
+        """按层级从浅到深创建目录（同步执行，需在工作线程中调用）"""
+        for dir_path in sorted(dirs, key=lambda path: len(path.parts)):
+            dir_path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _git_blob_sha(path: Path) -> str:
+        """计算文件的git blob SHA（与 Git Trees API 返回的sha一致）"""
+        with open(path, "rb") as f:
+            header = b"blob %d\x00" % os.fstat(f.fileno()).st_size
+            if hasattr(hashlib, "file_digest"):  # Python 3.11+
+                return hashlib.file_digest(f, lambda: hashlib.sha1(header)).hexdigest()
+            digest = hashlib.sha1(header)
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+            return digest.hexdigest()
+
+    def _hash_local_files(self, paths: list[str]) -> dict[str, str]:
+        """计算多个本地文件的git blob SHA（同步执行，需在工作线程中调用）"""
+        shas: dict[str, str] = {}
+        for path in paths:
+            try:
+                shas[path] = self._git_blob_sha(self.target_dir / path)
+            except OSError:
+                pass
+        return shas
+
+    async def _download_directory(self, files: dict[str, str]) -> bool:
+        """按 {文件路径: blob SHA} 并发下载目录中的文件（并发数受信号量限制）"""
+        # 一次遍历本地目录，过滤掉已存在且内容未变的文件，无需逐个 stat
+        local_index = await anyio.to_thread.run_sync(self._index_local)
+        to_fetch: list[str] = []
+        to_verify: list[str] = []
+        for path, sha in files.items():
+            size = local_index.get(path)
+            if size is None:
+                to_fetch.append(path)
+            elif sha and self._blob_shas.get(path) == sha:
+                continue  # 与上次下载的内容一致，无需任何请求
+            elif sha:
+                to_verify.append(path)
+            elif path in self._etags or size <= 100:
+                # 没有SHA时，有ETag的本地文件发送条件请求，没有ETag的按大小判断是否跳过
+                to_fetch.append(path)
+        if to_verify:
+            # 没有记录或记录不一致的本地文件，计算SHA后与仓库比较
+            local_shas = await anyio.to_thread.run_sync(self._hash_local_files, to_verify)
+            for path in to_verify:
+                if local_shas.get(path) == files[path]:
+                    self._blob_shas[path] = files[path]
+                    self._blob_shas_dirty = True
+                else:
+                    to_fetch.append(path)
+        # 切换源后重新执行时，之前已计入统计的文件不再重复计数
+        fetch_set = set(to_fetch)
+        for path in files:
+            if path not in fetch_set:
+                self._mark_skipped(path)
+        # 所有需要的目录只创建一次，下载过程中不再逐个文件创建
+        local_dirs = {(self.target_dir / path).parent for path in to_fetch}
+        await anyio.to_thread.run_sync(self._make_dirs, local_dirs)
+        results = await asyncio.gather(*(
+            self._download_file(
+                self._url_prefix + remote_path,
+                self.target_dir / remote_path,
+                # 有SHA的文件要么本地不存在，要么校验失败，都必须完整下载；
+                # 只有没有SHA的本地文件才发送条件请求，避免304让损坏的文件被保留
+                etag=(
+                    self._etags.get(remote_path)
+                    if remote_path in local_index and not files[remote_path]
+                    else None
+                )
+            )
+            for remote_path in to_fetch
+        ))
+        for remote_path, success in zip(to_fetch, results):
+            # 有SHA的文件不带条件请求，成功即表示已按200响应重新写入
+            if success and files[remote_path]:
+                self._blob_shas[remote_path] = files[remote_path]
+                self._blob_shas_dirty = True
+        # 任意文件下载失败，都需要切换源
+        return all(results)
+
+    async def _download_json_file(self) -> tuple[bool, Optional[dict]]:
         """下载并解析JSON文件"""
         json_path = self.target_dir / "doroendings.json"
         # 构建JSON文件URL
-        if self.current_source == "github":
-            raw_url = f"{self.raw_base_url}/doroendings.json"
-        else:  # gitee
-            raw_url = f"{self.raw_base_url}/doroendings.json"
-        # 下载JSON文件
-        success = self._download_file(raw_url, json_path)
-        if not success:
-            return False, None
-        # 验证JSON格式
-        try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                json_data = json.load(f)
-            logger.info(f"JSON文件验证成功，包含 {len(json_data)} 条记录")
-            return True, json_data
-        except json.JSONDecodeError as e:
-            logger.warning(f"JSON文件格式错误: {e}")
-            return False, None
-        except Exception as e:
-            logger.warning(f"JSON文件读取失败: {e}")
-            return False, None
+        raw_url = self._url_prefix + json_path.name
+        # 本地已有文件且记录了ETag时发送条件请求
+        etag = self._etags.get(json_path.name) if json_path.exists() else None
+        while True:
+            response = await self._make_request(raw_url, {'If-None-Match': etag} if etag else None)
+            if response is None:
+                if not self.use_gitee_fallback:
+                    self.failed_files += 1
+                return False, None
+            # 直接在内存中校验下载的内容，校验通过后才写入磁盘
+            try:
+                async with response:
+                    if response.status == 304:
+                        content = await anyio.Path(json_path).read_bytes()
+                        new_etag = None
+                    elif 200 <= response.status < 300:
+                        content = await response.read()
+                        new_etag = response.headers.get("ETag", "")
+                    else:
+                        logger.warning(f"JSON文件下载失败: HTTP状态码 {response.status}")
+                        if not self.use_gitee_fallback:
+                            self.failed_files += 1
+                        return False, None
+            except (aiohttp.ClientError, OSError) as e:
+                logger.warning(f"JSON文件下载失败: {e}")
+                if not self.use_gitee_fallback:
+                    self.failed_files += 1
+                return False, None
+            try:
+                json_data = loads_json(content)
+            except ValueError as e:
+                if new_etag is None:
+                    # 本地文件已损坏但服务器返回304：丢弃记录的ETag，重新完整下载
+                    logger.warning(f"本地JSON文件已损坏，重新下载: {e}")
+                    self._etags.pop(json_path.name, None)
+                    self._etags_dirty = True
+                    etag = None
+                    continue
+                logger.warning(f"JSON文件格式错误: {e}")
+                return False, None
+            break
+        if new_etag is None:
+            self._mark_skipped(json_path.name)
+        else:
+            await anyio.to_thread.run_sync(self._write_file, json_path, content)
+            if new_etag:
+                self._etags[json_path.name] = new_etag
+            else:
+                self._etags.pop(json_path.name, None)
+            self._etags_dirty = True
+            self._counted_paths.add(json_path.name)
+            self.downloaded_files += 1
+        logger.info(f"JSON文件验证成功，包含 {len(json_data)} 条记录")
+        return True, json_data
+
+    @staticmethod
+    def _write_file(path: Path, content: bytes) -> None:
+        """先写入临时文件再替换，避免留下不完整的文件（同步执行，需在工作线程中调用）"""
+        tmp_path = path.with_name(path.name + ".part")
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _is_success(result: Any) -> bool:
+        """操作返回 (是否成功, 数据) 元组时取第一个元素，否则按返回值的真假判断"""
+        if isinstance(result, tuple):
+            return bool(result[0])
+        return bool(result)
 
-    def _try_with_fallback(self, operation) -> tuple[bool, bool]:
+    async def _try_with_fallback(
+        self,
+        operation: Callable[[], Awaitable[Any]]
+    ) -> tuple[bool, bool, Any]:
         """
         尝试执行操作，如果失败则切换到备用源重试
         Returns:
-            tuple[bool, bool]: (操作是否成功, 是否切换了源)
+            tuple[bool, bool, Any]: (操作是否成功, 是否切换了源, 操作的返回值)
         """
         # 第一次尝试（GitHub）
-        result = operation()
-        if result:
-            return True, False  # 成功，未切换源
-        # 如果失败且允许切换到Gitee，且当前是GitHub源
-        if self.use_gitee_fallback and self.current_source == "github":
-            if self._switch_to_gitee():
-                # 使用Gitee重试
+        result = await operation()
+        if self._is_success(result):
+            return True, False, result  # 成功，未切换源
+        # 如果失败且允许使用备用源，切换到另一个源重试
+        if self.use_gitee_fallback:
+            self._switch_source()
+            if self.current_source == "gitee":
                 logger.info(f"使用Gitee源重试: {self.gitee_owner}/{self.gitee_repo}")
-                result = operation()
-                return result, True  # 返回结果和切换状态
-        return False, False
+            else:
+                logger.info(f"使用GitHub源重试: {self.repo_owner}/{self.repo_name}")
+            result = await operation()
+            return self._is_success(result), True, result  # 返回结果和切换状态
+        return False, False, result
+
+    def _load_record(self, file_name: str) -> dict[str, str]:
+        """读取下载目录中的记录文件（ETag、blob SHA），不存在或损坏时返回空字典（同步执行，需在工作线程中调用）"""
+        try:
+            return loads_json((self.target_dir / file_name).read_bytes())
+        except (OSError, ValueError):
+            return {}
 
-    def download(self) -> DownloadResult:
+    def _save_record(self, file_name: str, record: dict[str, str]) -> None:
+        """写入下载目录中的记录文件（同步执行，需在工作线程中调用）"""
+        (self.target_dir / file_name).write_bytes(dumps_json(record))
+
+    async def download(self) -> DownloadResult:
         """执行下载任务"""
+        # 创建目标目录
+        self.target_dir.mkdir(parents=True, exist_ok=True)
+        # 优先使用上次成功的源，避免每次都先等待不可用的源超时
+        if self.use_gitee_fallback:
+            preferred = await anyio.to_thread.run_sync(self._load_source_preference)
+            if preferred in ("github", "gitee") and preferred != self.current_source:
+                self.current_source = preferred
+                self._update_urls()
         logger.info(f"开始下载 {self.repo_owner}/{self.repo_name} (源: {self.current_source.upper()})")
         logger.info(f"保存到: {self.target_dir.absolute()}")
         logger.debug("-" * 50)
         start_time = time.time()
-        source_switched = False
-        # 创建目标目录
-        self.target_dir.mkdir(parents=True, exist_ok=True)
+        self._etags = await anyio.to_thread.run_sync(self._load_record, ETAG_FILE_NAME)
+        self._blob_shas = await anyio.to_thread.run_sync(self._load_record, BLOB_SHA_FILE_NAME)
         try:
-            # 获取仓库根目录内容
-            def get_root_contents():
-                response = self._make_request(self.base_api_url)
-                if response is None:
-                    return None
-                if response.status_code != 200:
-                    logger.error(f"无法访问仓库，HTTP状态码: {response.status_code}")
-                    return None
-                return response.json()
-            success, switched = self._try_with_fallback(get_root_contents)
-            if switched:
-                source_switched = True
+            # 获取仓库文件列表（一次请求获取整个仓库）
+            success, source_switched, root_contents = await self._try_with_fallback(self._list_tree)
             if not success:
                 return DownloadResult(
                     False,
                     "无法访问GitHub和Gitee仓库，请检查网络连接",
                     self.current_source
                 )
-            root_contents = get_root_contents() if success else None
-            if root_contents is None:
-                return DownloadResult(
-                    False,
-                    "无法获取仓库内容",
-                    self.current_source
-                )
             # 检查需要的文件/目录是否存在
-            has_doro_pic = False
-            has_json = False
-            for item in root_contents:
-                item_name = item.get('name', item.get('path', ''))
-                item_type = item.get('type', 'file')
-                if 'type' not in item and 'download_url' in item:
-                    item_type = 'file'
-                if item_name == "DoroEndingPic" and item_type == 'dir':
-                    has_doro_pic = True
-                elif item_name == "doroendings.json":
-                    has_json = True
-            # 下载DoroEndingPic目录
+            pic_files = {
+                path: sha for path, sha in root_contents.items()
+                if path.startswith("DoroEndingPic/")
+            }
+            has_doro_pic = bool(pic_files)
+            has_json = "doroendings.json" in root_contents
+            # 依次下载图片目录和JSON文件，每一步都可以单独切换到备用源
+            steps: list[tuple[str, Callable[[], Awaitable[Any]]]] = []
             if has_doro_pic:
-                pic_dir = self.target_dir / "DoroEndingPic"
-                pic_dir.mkdir(exist_ok=True)
-                logger.info(f"开始从{self.current_source.upper()}下载图片目录...")
-                def download_pic_dir():
-                    return self._download_directory("DoroEndingPic", pic_dir)
-                success, switched = self._try_with_fallback(download_pic_dir)
-                if switched:
-                    source_switched = True
-                if not success:
-                    logger.error("图片目录下载失败")
-            # 下载JSON文件
-            json_data = None
+                steps.append(("图片目录", functools.partial(self._download_directory, pic_files)))
             if has_json:
-                logger.info(f"开始从{self.current_source.upper()}下载JSON配置文件...")
-                def download_json():
-                    return self._download_json_file()
-                success, switched = self._try_with_fallback(lambda: self._download_json_file()[0])
-                if switched:
-                    source_switched = True
-                if success:
-                    json_data = self._download_json_file()[1]
-                else:
-                    logger.error("JSON文件下载失败")
+                steps.append(("JSON配置文件", self._download_json_file))
+            json_data = None
+            for step_name, operation in steps:
+                logger.info(f"开始从{self.current_source.upper()}下载{step_name}...")
+                success, switched, result = await self._try_with_fallback(operation)
+                source_switched |= switched
+                if not success:
+                    logger.error(f"{step_name}下载失败")
+                elif operation == self._download_json_file:
+                    json_data = result[1]
+            # 保存新的ETag和blob SHA记录，供下次跳过未变化的文件
+            if self._etags_dirty:
+                self._etags_dirty = False
+                try:
+                    await anyio.to_thread.run_sync(self._save_record, ETAG_FILE_NAME, dict(self._etags))
+                except OSError as e:
+                    logger.warning(f"保存ETag记录失败: {e}")
+            if self._blob_shas_dirty:
+                self._blob_shas_dirty = False
+                try:
+                    await anyio.to_thread.run_sync(
+                        self._save_record, BLOB_SHA_FILE_NAME, dict(self._blob_shas)
+                    )
+                except OSError as e:
+                    logger.warning(f"保存blob SHA记录失败: {e}")
             # 计算耗时
             elapsed_time = time.time() - start_time
             # 输出统计信息
@@ -320,6 +750,11 @@ class GitRepoDownloader:
             elif has_doro_pic and (not pic_dir.exists() or not any(pic_dir.iterdir())):
                 success = False
                 message = f"图片目录下载失败或为空 (数据源: {self.current_source.upper()})"
+            if success:
+                try:
+                    await anyio.to_thread.run_sync(self._save_source_preference)
+                except OSError as e:
+                    logger.warning(f"保存数据源记录失败: {e}")
             return DownloadResult(
                 success=success,
                 message=message,
@@ -336,7 +771,7 @@ class GitRepoDownloader:
             )
 
 
-def download_doro_assets(
+async def adownload_doro_assets(
     repo_owner: str = "SeeWhyRan",
     repo_name: str = "doroending_pic_assets",
     target_dir: str = "./data/doro_assets",
@@ -356,7 +791,7 @@ def download_doro_assets(
         gitee_owner: Gitee仓库所有者
         gitee_repo: Gitee仓库名称
     """
-    downloader = GitRepoDownloader(
+    async with GitRepoDownloader(
         repo_owner=repo_owner,
         repo_name=repo_name,
         target_dir=target_dir,
@@ -364,8 +799,8 @@ def download_doro_assets(
         use_gitee_fallback=use_gitee_fallback,
         gitee_owner=gitee_owner,
         gitee_repo=gitee_repo
-    )
-    result = downloader.download()
+    ) as downloader:
+        result = await downloader.download()
     return {
         'success': result.success,
         'message': result.message,
@@ -375,6 +810,27 @@ def download_doro_assets(
     }
 
 
+def download_doro_assets(
+    repo_owner: str = "SeeWhyRan",
+    repo_name: str = "doroending_pic_assets",
+    target_dir: str = "./data/doro_assets",
+    token: str = "",
+    use_gitee_fallback: bool = True,
+    gitee_owner: str = "seewhy_ran",
+    gitee_repo: str = "doroending_pic_assets"
+) -> dict:
+    """adownload_doro_assets 的同步版本（在没有运行中的事件循环时使用）"""
+    return asyncio.run(adownload_doro_assets(
+        repo_owner=repo_owner,
+        repo_name=repo_name,
+        target_dir=target_dir,
+        token=token,
+        use_gitee_fallback=use_gitee_fallback,
+        gitee_owner=gitee_owner,
+        gitee_repo=gitee_repo
+    ))
+
+
 def main():
     """直接运行测试"""
     logger.info("测试Git仓库资源下载...")